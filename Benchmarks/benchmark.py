@@ -0,0 +1,188 @@
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# Benchmarks of the simulator entry points of both labs, with fixed seeds and several problem sizes.
+# Every benchmark reports its best time over a few runs, the events processed per second, and the peak
+# memory allocated by Python during a separate run under tracemalloc. Results are compared against the
+# stored baseline.json, and the script exits with an error if any benchmark regressed beyond the tolerance.
+# Run it from anywhere with: python Benchmarks/benchmark.py [--sizes small medium] [--update-baseline]
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# Common goes first on the path, like in the labs, so installed packages with the same module names do not shadow it.
+sys.path.insert(0, os.path.join(ROOT, 'Common'))
+from rngstreams import RandomStream
+from metrics import Metrics
+from jit import NUMBA_AVAILABLE
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# The lab folders have spaces and # in their names, so the lab files are loaded by path.
+def load_lab(path, name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+lab1 = load_lab(os.path.join('Lab #1', 'Submission', 'lab1.py'), 'lab1')
+lab2 = load_lab(os.path.join('Lab #2', 'Submission', 'lab2.py'), 'lab2')
+
+# Lab 1 problem sizes as (T, rho), and lab 2 problem sizes as (N, A, T_sim).
+LAB1_SIZES = {"small": (100, 0.9), "medium": (300, 0.9), "large": (1000, 0.9)}
+LAB2_SIZES = {"small": (20, 7, 10), "medium": (60, 10, 10), "large": (100, 20, 10)}
+L, C, K = 2000, 10 ** 6, 25
+D, S, LAN_L, R = 10, 2 * (10 ** 8), 1500, 10 ** 6
+
+# Each benchmark is a function of the problem size that returns a run() function. Every call of run()
+# performs the measured work once from the same seed, and returns the number of events it processed.
+# Inputs that are not measured (e.g. the events of a DES) are built once, outside of run().
+def build_events_for_infinite_buffer(size):
+    T, rho = LAB1_SIZES[size]
+    return lambda: sum(len(store) for store in lab1.buildEventsForInfiniteBuffer(T, rho * C / L, L, C, RandomStream(1)))
+
+def infinite_buffer_des(size):
+    T, rho = LAB1_SIZES[size]
+    streams = lab1.buildEventsForInfiniteBuffer(T, rho * C / L, L, C, RandomStream(1))
+    events = sum(len(store) for store in streams)
+    def run():
+        lab1.infiniteBufferDes(lab1.mergeEventStreams(*streams), T, L, C)
+        return events
+    return run
+
+def build_events_for_finite_des(size):
+    T, rho = LAB1_SIZES[size]
+    return lambda: len(lab1.buildEventsForFiniteDes(T, rho * C / L, RandomStream(1)))
+
+def finite_buffer_des(size):
+    T, rho = LAB1_SIZES[size]
+    events = lab1.buildEventsForFiniteDes(T, rho * C / L, RandomStream(1))
+    def run():
+        lab1.finiteBufferDes(T, rho * C / L, L, C, K, events, rng=RandomStream(2))
+        # Departures are generated during the simulation, so only the arrivals and observers are counted.
+        return len(events)
+    return run
+
+# The nodes only generate their first block of packets when they are created, so this also generates the rest of
+# their packets up to T_sim, one block at a time like during a simulation, and counts every generated packet.
+def populate_nodes(size):
+    N, A, T_sim = LAB2_SIZES[size]
+    def run():
+        packets = 0
+        for node in lab2.populate_nodes(N, A, T_sim, rng=RandomStream(1)):
+            packets += len(node.arrival_times)
+            while node.last_arrival_time < node.T_sim:
+                node.generate_packets()
+                packets += len(node.arrival_times)
+        return packets
+    return run
+
+def csma_cd(simulate):
+    def benchmark(size):
+        N, A, T_sim = LAB2_SIZES[size]
+        def run():
+            # The transmission attempts are counted with metrics (see Common/metrics.py) rather than a trace sink, which
+            # would slow down the simulation and disable its compiled kernel. The simulators also print their results,
+            # which would only clutter the report.
+            metrics = Metrics()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                simulate(N, A, T_sim, D, S, LAN_L, R, rng=RandomStream(1), metrics=metrics)
+            return metrics.counters["events"]
+        return run
+    return benchmark
+
+BENCHMARKS = {
+    "buildEventsForInfiniteBuffer": build_events_for_infinite_buffer,
+    "infiniteBufferDes": infinite_buffer_des,
+    "buildEventsForFiniteDes": build_events_for_finite_des,
+    "finiteBufferDes": finite_buffer_des,
+    "populate_nodes": populate_nodes,
+    "persistent_csma_cd": csma_cd(lab2.persistent_csma_cd),
+    "non_persistent_csma_cd": csma_cd(lab2.non_persistent_csma_cd),
+}
+
+# Runs a benchmark at least repeat times, and for at least min_seconds in total so that short benchmarks are not
+# dominated by noise, and outputs its best time (in s), its events per second, its peak memory (in bytes,
+# measured during one extra run under tracemalloc, since tracing slows down the timed runs) and whether Numba was
+# installed, since the simulators run their compiled kernels when it is.
+def measure(run, repeat, min_seconds=1):
+    seconds = float('inf')
+    runs, total_seconds = 0, 0
+    while runs < repeat or total_seconds < min_seconds:
+        start = time.perf_counter()
+        events = run()
+        elapsed = time.perf_counter() - start
+        seconds = min(seconds, elapsed)
+        runs, total_seconds = runs + 1, total_seconds + elapsed
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": seconds, "events": events, "events_per_second": events / seconds, "peak_bytes": peak_bytes,
+            "numba": NUMBA_AVAILABLE}
+
+# Outputs the list of regressions of result against baseline: events per second lower, or peak memory higher,
+# than the baseline by more than tolerance (as a fraction of the baseline).
+def find_regressions(result, baseline, tolerance):
+    regressions = []
+    if result["events_per_second"] < baseline["events_per_second"] * (1 - tolerance):
+        regressions.append(f"events/s {result['events_per_second']:.0f} < {baseline['events_per_second']:.0f}")
+    if result["peak_bytes"] > baseline["peak_bytes"] * (1 + tolerance):
+        regressions.append(f"peak memory {result['peak_bytes']} B > {baseline['peak_bytes']} B")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the simulators of both labs against a stored baseline.")
+    parser.add_argument("--sizes", nargs="+", choices=list(LAB1_SIZES), default=list(LAB1_SIZES))
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--min-seconds", type=float, default=1)
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="store the results as the new baseline instead of comparing against it")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    results = {}
+    failed = False
+    print(f"{'benchmark':45} {'time (s)':>10} {'events/s':>12} {'peak (MB)':>10}")
+    for name in args.only:
+        for size in args.sizes:
+            key = f"{name}[{size}]"
+            results[key] = measure(BENCHMARKS[name](size), args.repeat, args.min_seconds)
+            result = results[key]
+            status = ""
+            if not args.update_baseline and key in baseline:
+                # Compiled and pure Python runs are not comparable, so only compare against a baseline recorded the same way.
+                # Baselines from before Numba was recorded were recorded without it.
+                baseline_numba = baseline[key].get("numba", False)
+                if baseline_numba != result["numba"]:
+                    status = f"not compared: baseline recorded {'with' if baseline_numba else 'without'} Numba"
+                else:
+                    regressions = find_regressions(result, baseline[key], args.tolerance)
+                    if regressions:
+                        failed = True
+                        status = "REGRESSION: " + ", ".join(regressions)
+            print(f"{key:45} {result['seconds']:10.3f} {result['events_per_second']:12.0f} {result['peak_bytes'] / 2**20:10.2f} {status}")
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+    elif failed:
+        sys.exit(f"Benchmarks regressed by more than {args.tolerance:.0%} from the baseline in {args.baseline}")
+
+if __name__ == "__main__":
+    main()
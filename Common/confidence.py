@@ -0,0 +1,42 @@
+import math
+from statistics import NormalDist
+
+# Approximate two sided Student's t quantile for the given confidence level and degrees of freedom,
+# using the Cornish-Fisher expansion around the normal quantile. It is accurate to about 1e-3 for 4 or
+# more degrees of freedom, which is plenty for deciding when to stop a simulation.
+def t_quantile(confidence, dof):
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    return (z
+        + (z**3 + z) / (4 * dof)
+        + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * dof**2)
+        + (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * dof**3)
+        + (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z) / (92160 * dof**4))
+
+# Returns the mean of the samples and the half width of its confidence interval.
+def confidence_interval(samples, confidence=0.95):
+    n = len(samples)
+    mean = sum(samples) / n
+    if n < 2:
+        return (mean, float('inf'))
+    variance = sum((x - mean) ** 2 for x in samples) / (n - 1)
+    return (mean, t_quantile(confidence, n - 1) * math.sqrt(variance / n))
+
+# Runs independent replications of a simulation until the confidence interval of every metric is precise
+# enough, i.e. its half width is at most relative_precision times its mean, or at most absolute_precision
+# (for metrics that are close to 0, such as a loss probability at low load).
+# replicate: function that runs one replication and returns a tuple of metrics.
+# The method outputs the tuple of means, the tuple of confidence interval half widths, and the number of
+# replications that were run (at least min_replications, at most max_replications).
+def run_until_precision(replicate, relative_precision=0.05, absolute_precision=0, confidence=0.95, min_replications=5, max_replications=100):
+    replications = []
+    while True:
+        replications.append(replicate())
+        if len(replications) < min_replications:
+            continue
+
+        intervals = [confidence_interval(samples, confidence) for samples in zip(*replications)]
+        precise = all(half_width <= max(relative_precision * abs(mean), absolute_precision) for mean, half_width in intervals)
+        if precise or len(replications) >= max_replications:
+            means = tuple(mean for mean, _ in intervals)
+            half_widths = tuple(half_width for _, half_width in intervals)
+            return (means, half_widths, len(replications))
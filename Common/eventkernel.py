@@ -0,0 +1,101 @@
+import heapq
+import itertools
+import operator
+
+# Discrete event kernel shared by the simulators of both labs. Scheduled events are kept in a binary
+# heap of compact [time, priority, sequence, event type, payload] lists, ordered by time, then priority
+# (lowest first), then the order they were scheduled in. Each event type has one handler, registered
+# with on(...), which is called as handler(time, payload) when the event is processed and can schedule,
+# cancel or reschedule other events.
+# Pre-generated, time ordered streams of events (such as an EventStore) are added with add_source(...).
+# They are not copied into the heap, but consumed lazily alongside it, as if all their events had been
+# scheduled with priority source_priority before any other event.
+class EventKernel:
+    def __init__(self, source_priority=0):
+        self.heap = []
+        self.handlers = {}
+        self.sequence = 0
+        self.source = iter(())
+        self.source_event = NO_EVENT
+        self.source_priority = source_priority
+        self.now = 0
+        self.processed = 0
+        self.stopped = False
+
+    # Registers handler(time, payload) for every event of event_type.
+    def on(self, event_type, handler):
+        self.handlers[event_type] = handler
+
+    # Schedules an event, and returns it so it can be cancelled or rescheduled.
+    def schedule(self, time, event_type, payload=None, priority=0):
+        self.sequence += 1
+        event = [time, priority, self.sequence, event_type, payload]
+        heapq.heappush(self.heap, event)
+        return event
+
+    # Cancelled events stay in the heap, and are skipped when they reach the top.
+    def cancel(self, event):
+        event[3] = None
+
+    # Cancels event and schedules it again at time, and returns the new event.
+    def reschedule(self, event, time):
+        _, priority, _, event_type, payload = event
+        self.cancel(event)
+        return self.schedule(time, event_type, payload, priority)
+
+    # Adds a time ordered iterable of (time, event type) pairs, whose events are processed with a None
+    # payload. Several sources are merged into one with heapq.merge.
+    def add_source(self, events):
+        if self.source_event is not NO_EVENT:
+            pending = itertools.chain([self.source_event], self.source)
+            events = heapq.merge(pending, events, key=operator.itemgetter(0))
+        self.source = iter(events)
+        self.source_event = next(self.source, NO_EVENT)
+
+    # Stops run(...) after the event that is being processed.
+    def stop(self):
+        self.stopped = True
+
+    # Processes events in order until there are none left, the next event is at or after until, or
+    # stop() is called. If a trace sink is given (see tracing.py), every processed event is recorded
+    # to it as a (time, event type) pair.
+    def run(self, until=float('inf'), trace=None):
+        # This is the hot loop of every simulator, so everything it uses is a local variable.
+        heap, handlers, heappop = self.heap, self.handlers, heapq.heappop
+        source, source_priority = self.source, self.source_priority
+        source_time, source_type = self.source_event
+        processed = 0
+        self.stopped = False
+        while not self.stopped:
+            if heap:
+                event = heap[0]
+                time = event[0]
+                from_heap = time < source_time or (time == source_time and event[1] < source_priority)
+            else:
+                from_heap = False
+
+            if from_heap:
+                if time >= until:
+                    break
+                heappop(heap)
+                event_type = event[3]
+                if event_type is None:
+                    continue
+                payload = event[4]
+            else:
+                time, event_type, payload = source_time, source_type, None
+                if event_type is None or time >= until:
+                    break
+                source_time, source_type = next(source, NO_EVENT)
+
+            self.now = time
+            processed += 1
+            if trace is not None:
+                trace.record(time, event_type)
+            handlers[event_type](time, payload)
+
+        self.source_event = (source_time, source_type) if source_type is not None else NO_EVENT
+        self.processed += processed
+
+# Marks the end of the sources.
+NO_EVENT = (float('inf'), None)
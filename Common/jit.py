@@ -0,0 +1,19 @@
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Optional just in time compilation of the sequential simulation loops with Numba, which is not
+# required to run the labs. Kernels decorated with jit only use plain float64 and int NumPy arrays,
+# numbers and math functions, so the same function runs compiled when Numba is installed, and as
+# ordinary (much slower) Python otherwise. The simulators only call their kernels when
+# NUMBA_AVAILABLE is set, and keep their pure Python path as the fallback.
+NUMBA_AVAILABLE = numba is not None
+
+def jit(function):
+    if numba is None:
+        return function
+    # Kernels are not cached on disk, since Numba cannot reload them from modules that were loaded by path (like the labs in
+    # Benchmarks/benchmark.py). They are compiled on their first call in each process.
+    return numba.njit(function)
+
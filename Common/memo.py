@@ -0,0 +1,149 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from array import array
+import numpy as np
+from rngstreams import RandomStream
+
+# Content addressed cache of simulation results on disk, shared by every process of a sweep.
+# Each result is a pickle file named after the hash of its key (see memoized(...)), and at most
+# max_entries results are kept: when a new one is added, the least recently used ones are evicted.
+class MemoCache:
+    def __init__(self, directory, max_entries=1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    # Returns (True, value) if key is in the cache, or (False, None) otherwise.
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return (False, None)
+        # The modification time of an entry is its last use. Another process may have evicted
+        # the entry since it was read, in which case the value is still returned.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return (True, value)
+
+    def put(self, key, value):
+        # Write to a temporary file first, so other processes never read a partial entry.
+        path = self.path(key)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as file:
+            pickle.dump(value, file)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+# The cache used by memoized functions, or None if caching is disabled (the default). Worker
+# processes forked after enable_cache(...) is called use the same cache.
+cache = None
+
+def enable_cache(directory, max_entries=1024):
+    global cache
+    cache = MemoCache(directory, max_entries)
+
+def disable_cache():
+    global cache
+    cache = None
+
+# Directory of the shared modules (event kernel, random streams, jit, confidence, ...), which every simulator imports.
+COMMON_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Hash of the source file of a function and of every module in COMMON_DIRECTORY. Editing the file or any shared
+# module changes the keys of all of its functions, so results computed by older code are never returned.
+@functools.lru_cache(maxsize=None)
+def code_hash(filename):
+    digest = hashlib.sha256()
+    common = sorted(entry.path for entry in os.scandir(COMMON_DIRECTORY) if entry.name.endswith(".py"))
+    for path in [os.path.abspath(filename)] + common:
+        with open(path, "rb") as file:
+            digest.update(os.path.basename(path).encode() + b"\0" + file.read())
+    return digest.hexdigest()
+
+# Converts an argument to something JSON can write for the key of a call. Arrays (including the
+# columns of an EventStore) are replaced by the hash of their contents, and random streams by their
+# full state, which is also collected into streams so it can be advanced on a cache hit.
+# Raises TypeError for arguments that cannot be part of a key, such as iterators.
+def describe(value, streams):
+    if isinstance(value, RandomStream):
+        streams.append(value)
+        return {"entropy": value.seed_sequence.entropy, "spawn_key": list(value.seed_sequence.spawn_key),
+                "antithetic": value.antithetic, "state": value.get_state()}
+    if isinstance(value, (array, np.ndarray)):
+        return {"type": type(value).__name__, "sha256": hashlib.sha256(memoryview(value).cast("B")).hexdigest()}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, functools.partial):
+        return {"function": value.func, "args": value.args, "keywords": value.keywords}
+    if callable(value):
+        return value.__qualname__
+    if hasattr(value, "__dict__"):
+        return {"type": type(value).__qualname__, "vars": vars(value)}
+    raise TypeError(f"cannot use {value!r} in a cache key")
+
+# Decorator for simulation functions that are pure once their random stream is fixed. While a cache
+# is enabled, a call whose key (function name, code hash, arguments and random stream states) is in
+# the cache returns the cached result without running, and leaves the random streams it was given in
+# the same state as running it would have. Arguments are bound to the signature of the function first,
+# so passing one by position or by keyword gives the same key. Calls with a trace sink or metrics
+# (either way), or with arguments that cannot be hashed (such as event iterators), always run.
+def memoized(function):
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if cache is None:
+            return function(*args, **kwargs)
+        try:
+            bound = signature.bind(*args, **kwargs)
+        except TypeError:
+            return function(*args, **kwargs)
+        bound.apply_defaults()
+        if bound.arguments.get("trace") is not None or bound.arguments.get("metrics") is not None:
+            return function(*args, **kwargs)
+
+        streams = []
+        try:
+            description = json.dumps([function.__qualname__, code_hash(function.__code__.co_filename), bound.arguments],
+                                     default=lambda value: describe(value, streams), sort_keys=True)
+        except (TypeError, ValueError):
+            return function(*args, **kwargs)
+        key = hashlib.sha256(description.encode()).hexdigest()
+
+        hit, value = cache.get(key)
+        if hit:
+            result, states = value
+            for stream, state in zip(streams, states):
+                stream.set_state(state)
+            return result
+
+        result = function(*args, **kwargs)
+        cache.put(key, (result, [stream.get_state() for stream in streams]))
+        return result
+    return wrapper
@@ -0,0 +1,63 @@
+import contextlib
+import json
+import time
+import tracemalloc
+from results import describe
+
+# Opt-in metrics of a simulation call. The simulators take it as their metrics parameter (None by
+# default, which costs nothing), time their phases with phase(...), and add their counters (events
+# processed, collisions, drops, ...) with count(...) once they are done, so the hot loops are not slowed
+# down. Use it as a context manager around the call to also measure the total wall time and, with
+# track_memory=True, the peak memory allocated by Python (using tracemalloc, which slows down the call).
+# report() outputs everything as a dict, and write(path) appends it to a JSON lines file.
+class Metrics:
+    def __init__(self, labels=None, track_memory=False):
+        self.labels = labels or {}
+        self.track_memory = track_memory
+        self.phases = {}
+        self.counters = {}
+        self.wall_seconds = None
+        self.peak_memory_bytes = None
+        self.started_tracing = False
+
+    def __enter__(self):
+        if self.track_memory:
+            self.started_tracing = not tracemalloc.is_tracing()
+            if self.started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_seconds = time.perf_counter() - self.start_time
+        if self.track_memory:
+            self.peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+            if self.started_tracing:
+                tracemalloc.stop()
+
+    # Adds the wall time of the with block to the phase name, e.g. with metrics.phase("build events"): ...
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    # Adds to counters, e.g. count(events=100, drops=2).
+    def count(self, **counts):
+        for name, value in counts.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        return {"labels": self.labels, "wall_seconds": self.wall_seconds, "phases": self.phases,
+                "counters": self.counters, "peak_memory_bytes": self.peak_memory_bytes}
+
+    def write(self, path):
+        with open(path, "a") as file:
+            file.write(json.dumps(self.report(), default=describe) + "\n")
+
+# metrics.phase(name) if metrics is given, or a no-op context otherwise.
+def phase(metrics, name):
+    return metrics.phase(name) if metrics is not None else contextlib.nullcontext()
@@ -0,0 +1,78 @@
+import functools
+import json
+import os
+from rngstreams import RandomStream
+
+# Converts the parts of a result key to something JSON can write: functions by their name (without
+# the module, which is __main__ when a lab file is run directly), partial functions by their
+# function and arguments, and random streams by the seed they draw from, so a key
+# only depends on what determines the result.
+def describe(value):
+    if isinstance(value, RandomStream):
+        seed_sequence = value.seed_sequence
+        return {"entropy": seed_sequence.entropy, "spawn_key": list(seed_sequence.spawn_key),
+                "antithetic": value.antithetic}
+    if isinstance(value, functools.partial):
+        return {"function": value.func, "args": value.args, "keywords": value.keywords}
+    if callable(value):
+        return value.__qualname__
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"cannot use {value!r} in a result key")
+
+# JSON turns tuples into lists, so the results read back are converted to tuples again.
+def to_tuples(value):
+    if isinstance(value, list):
+        return tuple(to_tuples(item) for item in value)
+    return value
+
+# On disk store of completed sweep points, kept as a JSON lines file with one {"key", "result"} object
+# per point. A point is written (and flushed) as soon as it completes, so a sweep that dies can be rerun
+# with the same store and seed, and only the points that are missing are simulated again.
+# The key of a point is its task, its full parameters and the seed of its random stream (see key(...)).
+# Points run with seed=None draw from fresh OS entropy, so they are stored but never reused.
+class ResultStore:
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    # A line cut short by a crash is skipped, and the point is simulated again.
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.results[entry["key"]] = to_tuples(entry["result"])
+        self.file = open(path, "a")
+        # Start on a new line if the last line was cut short.
+        if self.file.tell() > 0:
+            with open(path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read() != b"\n":
+                    self.file.write("\n")
+
+    # Returns the key for the given parts, e.g. key(simulate, params, rng).
+    @staticmethod
+    def key(*parts):
+        return json.dumps(parts, default=describe, sort_keys=True)
+
+    def __contains__(self, key):
+        return key in self.results
+
+    def __getitem__(self, key):
+        return self.results[key]
+
+    def __setitem__(self, key, result):
+        self.results[key] = result
+        self.file.write(json.dumps({"key": key, "result": result}, default=describe) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
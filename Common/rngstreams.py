@@ -0,0 +1,141 @@
+import math
+import os
+import numpy as np
+
+# Explicit random number stream for the simulations, which is passed into every builder and simulator
+# instead of using the global random and numpy.random state. Streams are seeded with a
+# numpy.random.SeedSequence, so a run can be reproduced from its seed, and spawn(...) creates child
+# streams that are statistically independent of each other, e.g. one per sweep point or replication.
+# Scalar draws are served from blocks of block_size uniforms, so they stay cheap in the hot loops.
+# An antithetic stream returns 1 - u for every uniform u its generator draws (see clone(...)).
+class RandomStream:
+    def __init__(self, seed=None, block_size=4096, antithetic=False):
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.generator = np.random.Generator(np.random.PCG64(seed))
+        self.block_size = block_size
+        self.antithetic = antithetic
+        self.buffer = []
+        self.buffer_state = None
+        self.index = 0
+
+    # Returns n independent child streams.
+    def spawn(self, n):
+        return [RandomStream(child, self.block_size, self.antithetic) for child in self.seed_sequence.spawn(n)]
+
+    # Returns a new stream that draws the same numbers as this stream did from its creation, including the
+    # child streams it spawns. With antithetic=True (or False), the copy instead draws 1 - u (or u) for every
+    # uniform u drawn by this stream, which is used to run antithetic pairs of replications.
+    def clone(self, antithetic=None):
+        seed = np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=self.seed_sequence.spawn_key,
+                                      pool_size=self.seed_sequence.pool_size)
+        return RandomStream(seed, self.block_size, self.antithetic if antithetic is None else antithetic)
+
+    # n uniform random variables in [0, 1), as a NumPy array.
+    def uniforms(self, n):
+        u = self.generator.random(n)
+        if self.antithetic:
+            # 1 - u is in (0, 1], so map 1 back to 0 to stay in [0, 1).
+            u = 1 - u
+            u[u == 1] = 0
+        return u
+
+    # Returns the current position of the stream as a dict of plain values, which set_state(...) restores.
+    # The buffer of scalar draws is not included, only the generator state it was drawn from.
+    def get_state(self):
+        return {"n_children_spawned": self.seed_sequence.n_children_spawned,
+                "generator": self.generator.bit_generator.state,
+                "buffer_state": self.buffer_state, "index": self.index}
+
+    def set_state(self, state):
+        self.seed_sequence = np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=self.seed_sequence.spawn_key,
+                                                    pool_size=self.seed_sequence.pool_size,
+                                                    n_children_spawned=state["n_children_spawned"])
+        self.buffer, self.buffer_state = [], state["buffer_state"]
+        if self.buffer_state is not None:
+            self.generator.bit_generator.state = self.buffer_state
+            self.buffer = self.uniforms(self.block_size).tolist()
+        self.generator.bit_generator.state = state["generator"]
+        self.index = state["index"]
+
+    # A single uniform random variable in [0, 1).
+    def uniform(self):
+        if self.index == len(self.buffer):
+            self.buffer_state = self.generator.bit_generator.state
+            self.buffer = self.uniforms(self.block_size).tolist()
+            self.index = 0
+        u = self.buffer[self.index]
+        self.index += 1
+        return u
+
+    # The next n scalar draws as a NumPy array, i.e. exactly the numbers that n calls of uniform() would
+    # return, leaving the stream where they would leave it. This hands pre-drawn uniforms to array
+    # kernels (see jit.py) without changing the results.
+    def next_uniforms(self, n):
+        head = self.buffer[self.index:self.index + n]
+        self.index += len(head)
+        parts = [np.array(head)]
+        remaining = n - len(head)
+        while remaining > 0:
+            self.buffer_state = self.generator.bit_generator.state
+            block = self.uniforms(self.block_size)
+            taken = min(remaining, self.block_size)
+            parts.append(block[:taken])
+            remaining -= taken
+            if remaining == 0:
+                self.buffer, self.index = block.tolist(), taken
+        return np.concatenate(parts)
+
+    # n exponential random variables with rate l, as a NumPy array, using the inverse transform.
+    def exponentials(self, l, n):
+        return (-1 / l) * np.log(1 - self.uniforms(n))
+
+    # A single exponential random variable with rate l, using the inverse transform.
+    def exponential(self, l):
+        return (-1 / l) * math.log(1 - self.uniform())
+
+    # A random integer in [a, b], including both end points.
+    def randint(self, a, b):
+        return a + int(self.uniform() * (b - a + 1))
+
+# The stream returned by ensure_stream(None), and the id of the process it was created in.
+default_stream = None
+default_stream_pid = None
+
+# Returns rng, or the default stream of this process if rng is None. This is how builders and simulators
+# that were not given a stream get one, so they never fall back to the global random state. The default
+# stream is seeded from fresh OS entropy on its first use in each process, so forked workers do not
+# inherit their parent's stream, and is then reused, since seeding a new stream for every scalar draw
+# would cost far more than the draw itself.
+def ensure_stream(rng):
+    global default_stream, default_stream_pid
+    if rng is not None:
+        return rng
+    if default_stream_pid != os.getpid():
+        default_stream, default_stream_pid = RandomStream(), os.getpid()
+    return default_stream
+
+# Returns one stream per point of a sweep of n points. By default every point gets an independent stream
+# spawned from seed. With common_random_numbers=True, every point gets its own copy of the same stream
+# instead, so the differences between points come from their parameters and not from the random numbers,
+# which gives much smoother curves for the same simulation time.
+def sweep_streams(seed, n, common_random_numbers=False):
+    root = RandomStream(seed)
+    if common_random_numbers:
+        return [root.clone() for i in range(n)]
+    return root.spawn(n)
+
+# Returns a replicate() function for run_until_precision(...) (see confidence.py) that runs simulate(stream)
+# on a new child stream of rng on every call, and returns its tuple of metrics. With antithetic=True, every
+# call runs simulate twice, on the child stream and on its antithetic clone, and returns the average of both
+# tuples. The two runs are negatively correlated, so the average has a lower variance than that of two
+# independent runs.
+def replications(simulate, rng, antithetic=False):
+    def replicate():
+        stream = rng.spawn(1)[0]
+        if not antithetic:
+            return simulate(stream)
+        results = (simulate(stream), simulate(stream.clone(antithetic=True)))
+        return tuple((a + b) / 2 for a, b in zip(*results))
+    return replicate
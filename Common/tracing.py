@@ -0,0 +1,51 @@
+import csv
+import struct
+
+# Base class for trace sinks, which the simulators call record(...) on for every event they
+# process when tracing is enabled. Only every sample_every-th event is written, so that long
+# runs can still be traced at a fraction of the I/O cost. Sinks buffer their writes and should
+# be closed (or used in a with statement) once the simulation is done.
+class TraceSink:
+    def __init__(self, file, sample_every=1):
+        self.file = file
+        self.sample_every = sample_every
+        self.count = 0
+
+    def record(self, *values):
+        if self.count % self.sample_every == 0:
+            self.write(values)
+        self.count += 1
+
+    def write(self, values):
+        raise NotImplementedError
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Writes each traced event as a row of a CSV file, with an optional header row.
+class CsvTraceSink(TraceSink):
+    def __init__(self, path, header=None, sample_every=1, buffer_size=1 << 20):
+        super().__init__(open(path, "w", newline="", buffering=buffer_size), sample_every)
+        self.writer = csv.writer(self.file)
+        if header is not None:
+            self.writer.writerow(header)
+
+    def write(self, values):
+        self.writer.writerow(values)
+
+# Writes each traced event as a fixed size binary record packed with the given struct
+# format, e.g. "<dB" for a (time, event type) pair. Records can be read back with
+# struct.iter_unpack(...) or numpy.fromfile(...).
+class BinaryTraceSink(TraceSink):
+    def __init__(self, path, fmt, sample_every=1, buffer_size=1 << 20):
+        super().__init__(open(path, "wb", buffering=buffer_size), sample_every)
+        self.pack = struct.Struct(fmt).pack
+
+    def write(self, values):
+        self.file.write(self.pack(*values))
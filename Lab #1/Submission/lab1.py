@@ -1,11 +1,28 @@
-import random
+import os
+import sys
 import math
 import time
 from enum import Enum
+from array import array
+import numpy as np
 import matplotlib.pyplot as plt
 
-from multiprocessing import Pool, cpu_count
-from collections import deque
+from multiprocessing import Pool, cpu_count, shared_memory, resource_tracker
+from contextlib import contextmanager
+from heapq import merge
+from itertools import tee
+from operator import itemgetter
+
+# Helpers shared by both labs live in the Common folder at the root of the repo. It goes first on the path,
+# so installed packages with the same generic module names (metrics, results, memo, ...) do not shadow them.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from confidence import run_until_precision
+from rngstreams import RandomStream, ensure_stream, sweep_streams, replications
+from results import ResultStore
+from memo import memoized
+from eventkernel import EventKernel
+from metrics import Metrics, phase
+from jit import jit, NUMBA_AVAILABLE
 
 # Enumeration that defines the different event types.
 class EventType(Enum):
@@ -13,76 +30,188 @@ class EventType(Enum):
     DEPARTURE = 1
     OBSERVER = 2
 
-# Data structure that describes an event based on it's simulation time and type.
-class Event:
-    def __init__(self, time, event_type):
-        self.time = time
-        self.event_type = event_type
-
-def generateRandomVariable(l=75):
-    u = random.uniform(0, 1)
-    x = (-1 / l) * math.log(1 - u)
-    return x
-
-def buildEventsForInfiniteBuffer(T, l, L, C):
-    event_queue = []
-    delta_t, obs_t = 0, 0
-
+# Integer codes of each event type. Events are passed around as (time, event type code)
+# pairs, so type checks in the DES loops are integer comparisons.
+ARRIVAL, DEPARTURE, OBSERVER = EventType.ARRIVAL.value, EventType.DEPARTURE.value, EventType.OBSERVER.value
+
+# Compact store of time ordered events. Times are kept in an array('d') and event type
+# codes in an array('b'), so each event takes 9 bytes instead of a full Python object.
+# Iterating over the store yields (time, event type code) pairs.
+class EventStore:
+    def __init__(self, times=b'', event_types=b''):
+        self.times = array('d', times)
+        self.event_types = array('b', event_types)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        return zip(self.times, self.event_types)
+
+    # Builds a store from (times, event type code) pairs, where times is a sorted NumPy
+    # array, by merging all of them into a single time ordered stream.
+    @classmethod
+    def fromTimes(cls, *streams):
+        times = np.concatenate([stream_times for stream_times, _ in streams])
+        event_types = np.concatenate([np.full(len(stream_times), event_type, dtype=np.int8) for stream_times, event_type in streams])
+        order = np.argsort(times, kind='stable')
+        return cls(times[order].tobytes(), event_types[order].tobytes())
+
+# All random variables are drawn from an explicit RandomStream (see Common/rngstreams.py),
+# which every builder and simulator below takes as its rng parameter. If no stream is given,
+# the default stream of the process is used (see ensure_stream(...)), which is seeded from
+# fresh OS entropy, so results are only reproducible when a seeded stream is passed in.
+# The inverse transform itself is RandomStream.exponential(...).
+def generateRandomVariable(l=75, rng=None):
+    return ensure_stream(rng).exponential(l)
+
+# Vectorized version of generateRandomVariable, returns n exponential random variables
+# with rate l as a NumPy array using the same inverse transform.
+def generateRandomVariables(l, n, rng=None):
+    return ensure_stream(rng).exponentials(l, n)
+
+# Generates the timestamps of a Poisson process with rate l over [0, T). Inter-arrival
+# times are drawn in blocks and accumulated with a cumulative sum, and new blocks are
+# drawn until the horizon T is covered.
+def generateArrivalTimes(T, l, block_size=None, rng=None):
+    rng = ensure_stream(rng)
+
+    # Size the block to the expected number of events plus a few standard deviations,
+    # so that a single block covers T in almost every call.
+    if block_size is None:
+        block_size = int(l * T + 5 * math.sqrt(l * T)) + 1
+
+    blocks = []
+    last_time = 0
+    while last_time < T:
+        times = last_time + np.cumsum(generateRandomVariables(l, block_size, rng))
+        blocks.append(times)
+        last_time = times[-1]
+
+    times = np.concatenate(blocks)
+    return times[:np.searchsorted(times, T)]
+
+# Returns the arrival and observer timestamps as arrays, with observers generated at
+# a rate 5x that of arrivals.
+def buildArrivalAndObserverTimes(T, l, rng=None):
+    # The arrivals and observers draw from their own child streams of rng, so with common random
+    # numbers the i-th arrival of every value of rho uses the same uniform, no matter how many
+    # arrivals or observers were drawn before it.
+    arrival_rng, observer_rng = ensure_stream(rng).spawn(2)
+    return (generateArrivalTimes(T, l, rng=arrival_rng), generateArrivalTimes(T, 5 * l, rng=observer_rng))
+
+# Computes the departure times of a FIFO queue with a single server from its arrival
+# and service times. This is the Lindley recursion d_i = max(a_i, d_(i-1)) + s_i, which
+# unrolls to d_i = S_i + max over j <= i of (a_j - S_(j-1)), where S_i is the cumulative
+# service time. That lets us evaluate it with a running maximum instead of a Python loop.
+def computeDepartureTimes(arrival_times, service_times):
+    cumulative_service = np.cumsum(service_times)
+    return cumulative_service + np.maximum.accumulate(arrival_times - (cumulative_service - service_times))
+
+# Returns the arrival, departure and observer times for the infinite buffer case as
+# sorted arrays.
+def buildTimesForInfiniteBuffer(T, l, L, C, rng=None):
+    rng = ensure_stream(rng)
+    arrival_times, observer_times = buildArrivalAndObserverTimes(T, l, rng)
+
+    # Compute the service time as L / C, where L follows exp. dist.
+    service_times = generateRandomVariables(1 / L, len(arrival_times), rng) / C
+    departure_times = computeDepartureTimes(arrival_times, service_times)
+    return (arrival_times, departure_times, observer_times)
+
+# Returns the arrival, departure and observer events as three separate event stores. Each
+# store is already in time order, so they are merged lazily by the DES with
+# mergeEventStreams(...) instead of being sorted into one list here.
+def buildEventsForInfiniteBuffer(T, l, L, C, rng=None):
+    arrival_times, departure_times, observer_times = buildTimesForInfiniteBuffer(T, l, L, C, rng)
+
+    arrival_events = EventStore.fromTimes((arrival_times, ARRIVAL))
+    departure_events = EventStore.fromTimes((departure_times, DEPARTURE))
+    observer_events = EventStore.fromTimes((observer_times, OBSERVER))
+    return (arrival_events, departure_events, observer_events)
+
+# Lazily merges time ordered event streams into a single time ordered stream, by always
+# taking the earliest head of the streams.
+def mergeEventStreams(*streams):
+    return merge(*streams, key=itemgetter(0))
+
+# Lazily yields exponential random variables with rate l, drawn from NumPy in small blocks.
+def generateRandomVariableStream(l, block_size=1024, rng=None):
+    rng = ensure_stream(rng)
+    while True:
+        yield from generateRandomVariables(l, block_size, rng).tolist()
+
+# Lazily yields the timestamps of a Poisson process with rate l over [0, T).
+def generateArrivalTimeStream(T, l, rng=None):
+    event_time = 0
+    for inter_arrival_time in generateRandomVariableStream(l, rng=rng):
+        event_time += inter_arrival_time
+        if event_time >= T:
+            return
+        yield event_time
+
+# Lazily yields the departure time of each arrival with the Lindley recursion, drawing
+# each service time as L / C, where L follows exp. dist.
+def generateDepartureTimeStream(arrival_times, L, C, rng=None):
     last_departure_time = 0
-    while delta_t < T or obs_t < T:
-        if delta_t < T:
-            # Determine the next arrival event time, create the arrival event, and
-            # add it to the queue.
-            delta_t += generateRandomVariable(l)
-            arrival_event = Event(delta_t, EventType.ARRIVAL)
-            event_queue.append(arrival_event)
-
-            # Compute the service time as L / C, where L follows exp. dist.
-            service_time = generateRandomVariable(1 / L) / C
-
-            # If arrival time occurs before last departure event has exited queue,
-            # then we compute departure event time as last time + service time. Otherwise,
-            # compute as arrival time + service time (no other packets in queue).
-            if arrival_event.time < last_departure_time:
-                departure_event = Event(last_departure_time + service_time, EventType.DEPARTURE)
-            else:
-                departure_event = Event(arrival_event.time + service_time, EventType.DEPARTURE)
-            last_departure_time = departure_event.time
-
-            event_queue.append(departure_event)
-        
-        if obs_t < T:
-            # Add observer events at a rate 5x that of arrival events.
-            obs_t += generateRandomVariable(5 * l)
-            observer_event = Event(obs_t, EventType.OBSERVER)
-            event_queue.append(observer_event)
-    
-    event_queue.sort(key=lambda x: x.time, reverse=True)
-    return event_queue
-
-def infiniteBufferDes(events, T, L, C):
+    for arrival_time, packet_length in zip(arrival_times, generateRandomVariableStream(1 / L, rng=rng)):
+        last_departure_time = max(arrival_time, last_departure_time) + packet_length / C
+        yield last_departure_time
+
+# Streaming counterpart of buildEventsForInfiniteBuffer(...). Returns the arrival, departure
+# and observer events as three generators, so events are only created as the DES consumes
+# them. The arrival times are shared between the arrival and departure streams with tee(...),
+# which only buffers the packets that are currently in the queue, so memory stays flat
+# regardless of T.
+# Each stream draws from its own child stream of rng, since the order in which the streams
+# are consumed depends on the merge.
+def streamEventsForInfiniteBuffer(T, l, L, C, rng=None):
+    arrival_rng, departure_rng, observer_rng = ensure_stream(rng).spawn(3)
+    arrival_times, departure_arrival_times = tee(generateArrivalTimeStream(T, l, arrival_rng))
+
+    arrival_events = ((event_time, ARRIVAL) for event_time in arrival_times)
+    departure_events = ((event_time, DEPARTURE) for event_time in generateDepartureTimeStream(departure_arrival_times, L, C, departure_rng))
+    observer_events = ((event_time, OBSERVER) for event_time in generateArrivalTimeStream(T, 5 * l, observer_rng))
+    return (arrival_events, departure_events, observer_events)
+
+# Runs the DES over a time ordered iterable of (time, event type code) pairs, e.g. an
+# EventStore or the output of mergeEventStreams(...).
+# If a trace sink is given (see Common/tracing.py), every processed event is recorded to it
+# as a (time, event type) pair, e.g. BinaryTraceSink("trace.bin", "<dB").
+# If metrics are given (see Common/metrics.py), the DES time and the number of processed
+# events, arrivals, departures and observations are added to them.
+# Results for an EventStore are cached while the cache in Common/memo.py is enabled.
+@memoized
+def infiniteBufferDes(events, T, L, C, trace=None, metrics=None):
     # Setup variables for computing e_n and p_idle.
     num_arrivals, num_departures, total_packets, observations, empty_counter = 0, 0, 0, 0, 0
 
-    while len(events) > 0:
-        event = events.pop()
-        if event.time >= T:
-            break
+    # Every event comes from events and none are scheduled on the fly, so unlike the
+    # finite buffer case, this loops over them directly instead of running the event
+    # kernel, which would add a handler call per event for nothing.
+    with phase(metrics, "des"):
+        for event_time, event_type in events:
+            if event_time >= T:
+                break
 
-        print(event.time, event.event_type)
+            if trace is not None:
+                trace.record(event_time, event_type)
 
-        if event.event_type == EventType.ARRIVAL:
-            num_arrivals += 1
-        elif event.event_type == EventType.DEPARTURE:
-            num_departures += 1
-        else:
-            # Determine the buffer length and increment total packets that have
-            # been observed.
-            buffer_length = num_arrivals - num_departures
-            total_packets += buffer_length
-            observations += 1
-            if buffer_length == 0:
-                empty_counter += 1
+            if event_type == ARRIVAL:
+                num_arrivals += 1
+            elif event_type == DEPARTURE:
+                num_departures += 1
+            else:
+                # Determine the buffer length and increment total packets that have
+                # been observed.
+                buffer_length = num_arrivals - num_departures
+                total_packets += buffer_length
+                observations += 1
+                if buffer_length == 0:
+                    empty_counter += 1
+    if metrics is not None:
+        metrics.count(events=num_arrivals + num_departures + observations, arrivals=num_arrivals, departures=num_departures,
+                      observations=observations)
     
     # e_n is average # of packets based on total # of observer events.
     e_n = total_packets / observations
@@ -92,23 +221,89 @@ def infiniteBufferDes(events, T, L, C):
     p_idle = (empty_counter / observations) * 100 
     return (e_n, p_idle)
 
-def buildEventsForFiniteDes(T, l):
-    event_queue = deque()
-    delta_t, obs_t = 0, 0
-
+# Array based engine for the infinite buffer case. Since arrival and departure times are
+# sorted, the number of packets in the buffer at each observer is the number of arrivals
+# minus the number of departures up to that time, which two binary searches give us
+# without replaying every event. Returns the same (e_n, p_idle) tuple as infiniteBufferDes.
+def lindleyInfiniteBufferDes(arrival_times, departure_times, observer_times, T, metrics=None):
+    with phase(metrics, "des"):
+        observer_times = observer_times[observer_times < T]
+        buffer_lengths = np.searchsorted(arrival_times, observer_times, side='right') - np.searchsorted(departure_times, observer_times, side='right')
+    if metrics is not None:
+        metrics.count(observations=len(observer_times))
+
+    e_n = buffer_lengths.sum() / len(observer_times)
+    p_idle = (np.count_nonzero(buffer_lengths == 0) / len(observer_times)) * 100
+    return (float(e_n), float(p_idle))
+
+def buildEventsForFiniteDes(T, l, rng=None):
     # only generate arrival and observer events since departure events
     # will be created during the simulation
-    while delta_t < T or obs_t < T:
-        if delta_t < T:
-            delta_t += generateRandomVariable(l)
-            event_queue.appendleft(Event(delta_t, EventType.ARRIVAL))
+    arrival_times, observer_times = buildArrivalAndObserverTimes(T, l, rng)
+
+    # merge both streams into a single time ordered event store
+    return EventStore.fromTimes((arrival_times, ARRIVAL), (observer_times, OBSERVER))
+
+# Array version of the finite buffer DES below, compiled with Numba when it is installed
+# (see Common/jit.py). times and event_types are the columns of an EventStore as NumPy
+# arrays, and uniforms[i] is the uniform from which the service time of the i-th accepted
+# packet is drawn. Departures are always in time order, so they are kept in a FIFO array
+# instead of a heap, and are processed before arrivals and observers at the same time,
+# like in the event kernel. Returns the counters of finiteBufferDes(...) and the number of
+# processed events. One uniform is used per accepted packet, i.e. num_arrivals of them.
+@jit
+def finiteBufferKernel(times, event_types, uniforms, T, L, C, K):
+    num_arrivals, num_departures, total_packets, observations, empty_counter = 0, 0, 0, 0, 0
+    last_departure_time, loss_counter, lost_arrivals, processed = 0.0, 0, 0, 0
+    departures = np.empty(len(times))
+    next_departure, next_event = 0, 0
+    while True:
+        if next_departure < num_arrivals and (next_event == len(times) or departures[next_departure] <= times[next_event]):
+            if departures[next_departure] >= T:
+                break
+            next_departure += 1
+            num_departures += 1
+            processed += 1
+            continue
 
-        if obs_t < T:
-            obs_t += generateRandomVariable(5 * l)
-            event_queue.appendleft(Event(obs_t, EventType.OBSERVER))
-    return event_queue
+        if next_event == len(times) or times[next_event] >= T:
+            break
+        event_time, event_type = times[next_event], event_types[next_event]
+        next_event += 1
+        processed += 1
 
-def finiteBufferDes(T, l, L, C, K, events):
+        buffer_length = num_arrivals - num_departures
+        if event_type == ARRIVAL:
+            if buffer_length == K:
+                loss_counter += 1
+                lost_arrivals += 1
+                continue
+            service_time = (-1 / (1 / L)) * math.log(1 - uniforms[num_arrivals]) / C
+            if buffer_length == 0:
+                last_departure_time = service_time + event_time
+            else:
+                last_departure_time += service_time
+            departures[num_arrivals] = last_departure_time
+            num_arrivals += 1
+            if last_departure_time >= T:
+                break
+        elif event_type == OBSERVER:
+            total_packets += buffer_length
+            observations += 1
+            if buffer_length == 0:
+                empty_counter += 1
+    return (num_arrivals, num_departures, total_packets, observations, empty_counter, loss_counter,
+            lost_arrivals, processed)
+
+# If a trace sink is given, every processed event (including dropped arrivals) is recorded
+# to it as a (time, event type) pair. If metrics are given, the DES time and the number of
+# processed events, accepted arrivals, drops, departures and observations are added to them.
+# When Numba is installed, events is an EventStore and there is no trace sink, the loop
+# runs as the compiled finiteBufferKernel(...), which gives the same results from the
+# same rng. compiled=True or False forces the kernel or the event kernel path, and
+# compiled=True raises ValueError with a trace sink, which the kernel cannot record to.
+@memoized
+def finiteBufferDes(T, l, L, C, K, events, trace=None, rng=None, metrics=None, compiled=None):
     # setup variables for computing e_n and p_loss
     # num_arrivals: number of arrival events of packets that 
     # are not dropped
@@ -125,65 +320,153 @@ def finiteBufferDes(T, l, L, C, K, events):
     num_arrivals, num_departures, total_packets, observations, empty_counter = 0, 0, 0, 0, 0
     last_departure_time, loss_counter = 0, 0
     lost_arrivals = 0
+    rng = ensure_stream(rng)
+
+    if compiled is None:
+        compiled = NUMBA_AVAILABLE and trace is None and isinstance(events, EventStore)
+    elif compiled and (trace is not None or not isinstance(events, EventStore)):
+        raise ValueError("compiled=True needs an EventStore and no trace sink")
+    if compiled:
+        times = np.frombuffer(events.times, dtype=np.float64)
+        event_types = np.frombuffer(events.event_types, dtype=np.int8)
+        with phase(metrics, "des"):
+            # Pre-draw one uniform per arrival, then only consume the ones used for the
+            # accepted packets, so rng ends up where the event kernel path leaves it.
+            state = rng.get_state()
+            uniforms = rng.next_uniforms(np.count_nonzero(event_types == ARRIVAL))
+            (num_arrivals, num_departures, total_packets, observations, empty_counter, loss_counter,
+             lost_arrivals, processed) = finiteBufferKernel(times, event_types, uniforms, T, L, C, K)
+            rng.set_state(state)
+            rng.next_uniforms(num_arrivals)
+        return finiteBufferResults(num_arrivals, num_departures, total_packets, observations, empty_counter,
+                                   loss_counter, lost_arrivals, processed, metrics)
+
+    # Note: num_arrivals only refers to packets that will have a 
+    # corresponding departure
+    def arrival(event_time, payload):
+        nonlocal num_arrivals, loss_counter, lost_arrivals, last_departure_time
+        buffer_length = num_arrivals - num_departures
+        # if buffer is full, the packet will be dropped
+        if buffer_length == K:
+            loss_counter += 1
+            lost_arrivals += 1
+            return
+
+        # the service rate follows an exponential distribution 
+        service_time = generateRandomVariable(1 / L, rng) / C
+        # if buffer is empty, departure time is the 
+        # service time + the arrival time
+        # if buffer is not empty, departure time is 
+        # the service time + the departure time 
+        # of the last packet
+        if buffer_length == 0:
+            last_departure_time = service_time + event_time
+        else:
+            last_departure_time += service_time
+        kernel.schedule(last_departure_time, DEPARTURE, priority=-1)
+        num_arrivals += 1
 
-    departure_times = deque()
-    while events:
-        departure_time = departure_times[-1] if departure_times else float('inf')
-        event = events[-1]
+        # exit function once a departure is past the simulation time
+        if last_departure_time >= T:
+            kernel.stop()
 
-        # exit function if event time or departure time is greater 
-        # than the simulation time
-        if event.time >= T or last_departure_time >= T:
-            break
+    def departure(event_time, payload):
+        nonlocal num_departures
+        num_departures += 1
 
-        # Note: num_arrivals only refers to packets that will have a 
-        # corresponding departure
+    def observer(event_time, payload):
+        nonlocal total_packets, observations, empty_counter
         buffer_length = num_arrivals - num_departures
-        if event.time < departure_time:
-            events.pop()
-            if event.event_type == EventType.ARRIVAL:
-                # print("ARRIVAL", event.time)
-                # if buffer is full, the packet will be dropped
-                if buffer_length == K:
-                    loss_counter += 1
-                    lost_arrivals += 1
-                    continue
-
-                # the service rate follows an exponential distribution 
-                service_time = generateRandomVariable(1 / L) / C
-                # if buffer is empty, departure time is the 
-                # service time + the arrival time
-                # if buffer is not empty, departure time is 
-                # the service time + the departure time 
-                # of the last packet
-                if buffer_length == 0:
-                    last_departure_time = service_time + event.time
-                    departure_times.appendleft(last_departure_time)
-                else:
-                    last_departure_time += service_time
-                    departure_times.appendleft(last_departure_time)
-                
-                num_arrivals += 1
-            else:
-                # print("OBSERVER", event.time)
-                total_packets += buffer_length
-                observations += 1
-                if buffer_length == 0:
-                    empty_counter += 1
-        else:
-            # print("DEPARTURE", departure_time)
-            departure_times.pop()
-            num_departures += 1
+        total_packets += buffer_length
+        observations += 1
+        if buffer_length == 0:
+            empty_counter += 1
+
+    # events is a time ordered iterable of (time, event type code) pairs,
+    # e.g. an EventStore, which is fed to the event kernel (see
+    # Common/eventkernel.py) as a source, while departure events are
+    # scheduled as packets are accepted. Departures have a lower priority
+    # value, so they are processed before arrivals and observers at the
+    # same time.
+    kernel = EventKernel()
+    kernel.on(ARRIVAL, arrival)
+    kernel.on(DEPARTURE, departure)
+    kernel.on(OBSERVER, observer)
+    kernel.add_source(events)
+    with phase(metrics, "des"):
+        kernel.run(until=T, trace=trace)
+    return finiteBufferResults(num_arrivals, num_departures, total_packets, observations, empty_counter,
+                               loss_counter, lost_arrivals, kernel.processed, metrics)
+
+# Computes the (e_n, p_loss, p_idle) tuple of finiteBufferDes(...) from its counters, and
+# adds them to metrics if given.
+def finiteBufferResults(num_arrivals, num_departures, total_packets, observations, empty_counter,
+                        loss_counter, lost_arrivals, processed, metrics):
+    if metrics is not None:
+        metrics.count(events=processed, arrivals=num_arrivals, drops=loss_counter, departures=num_departures,
+                      observations=observations)
     
     e_n = total_packets / observations
     p_loss = (loss_counter / (num_arrivals + lost_arrivals)) * 100
     p_idle = (empty_counter / observations) * 100
     return (e_n, p_loss, p_idle)
 
-def q1():
+# Closed form results for the M/M/1 queue, E[N] = rho / (1 - rho) and P_idle = 1 - rho, as the
+# same (e_n, p_idle) tuple as infiniteBufferDes. Returns None for rho >= 1, since the queue then
+# has no steady state and must be simulated.
+def analyticInfiniteBuffer(rho):
+    if rho >= 1:
+        return None
+    return (rho / (1 - rho), (1 - rho) * 100)
+
+# Closed form results for the M/M/1/K queue, where K is the maximum number of packets in the
+# system, as the same (e_n, p_loss, p_idle) tuple as finiteBufferDes. The probability of n
+# packets in the system is P_n = (1 - rho) * rho^n / (1 - rho^(K + 1)), or 1 / (K + 1) for
+# rho = 1, so P_loss = P_K and P_idle = P_0.
+def analyticFiniteBuffer(rho, K):
+    if math.isclose(rho, 1):
+        e_n = K / 2
+        p_0 = p_K = 1 / (K + 1)
+    else:
+        e_n = rho / (1 - rho) - (K + 1) * rho ** (K + 1) / (1 - rho ** (K + 1))
+        p_0 = (1 - rho) / (1 - rho ** (K + 1))
+        p_K = p_0 * rho ** K
+    return (e_n, p_K * 100, p_0 * 100)
+
+# Regression oracle for the simulations. Compares each simulated metric against its closed
+# form value, and prints and returns the (index, simulated, expected) of every metric that is
+# outside both the relative and absolute tolerances.
+def checkAgainstAnalytic(label, simulated, expected, relative_tolerance=0.05, absolute_tolerance=0.5):
+    mismatches = []
+    for i, (simulated_value, expected_value) in enumerate(zip(simulated, expected)):
+        if not math.isclose(simulated_value, expected_value, rel_tol=relative_tolerance, abs_tol=absolute_tolerance):
+            mismatches.append((i, simulated_value, expected_value))
+            print(f"{label}: metric {i} is {simulated_value}, expected {expected_value}")
+    return mismatches
+
+# Checks that the compiled finiteBufferKernel(...) and the event kernel path of
+# finiteBufferDes(...) give the same results and leave rng in the same state, for every
+# seed and K. Without Numba, the kernel runs as Python, which checks its logic only.
+# Prints and returns the (seed, K, kernel result, event kernel result) of every mismatch.
+def checkCompiledKernel(seeds=(1, 2, 3), K_steps=(1, 10, 50), T=100, rho=0.95, L=2000, C=10 ** 6):
+    mismatches = []
+    for seed in seeds:
+        l = rho * C / L
+        events = buildEventsForFiniteDes(T, l, RandomStream(seed))
+        for K in K_steps:
+            kernel_rng, event_rng = RandomStream(seed + 1), RandomStream(seed + 1)
+            kernel_result = finiteBufferDes(T, l, L, C, K, events, rng=kernel_rng, compiled=True)
+            event_result = finiteBufferDes(T, l, L, C, K, events, rng=event_rng, compiled=False)
+            if kernel_result != event_result or kernel_rng.get_state() != event_rng.get_state():
+                mismatches.append((seed, K, kernel_result, event_result))
+                print(f"seed {seed}, K = {K}: kernel gives {kernel_result}, event kernel gives {event_result}")
+    return mismatches
+
+def q1(seed=None):
+    rng = RandomStream(seed)
     random_variables = []
     for i in range(0, 1000):
-        random_variables.append(generateRandomVariable())
+        random_variables.append(generateRandomVariable(rng=rng))
 
     mean = sum(random_variables) / len(random_variables)
     variance = sum((xi - mean) ** 2 for xi in random_variables) / len(random_variables)
@@ -193,11 +476,133 @@ def q1():
     # https://math.berkeley.edu/~scanlon/m16bs04/ln/16b2lec31.pdf
     print(mean, variance)
 
-def infiniteBufferDesWrapper(args):
-    return infiniteBufferDes(*args)
-
-def buildEventsForInfiniteBufferWrapper(args):
-    return buildEventsForInfiniteBuffer(*args)
+# Builds the events and runs the DES in the same worker, so only the result is sent back
+# to the parent process instead of the full lists of events.
+@memoized
+def infiniteBufferDesWrapper(args, metrics=None):
+    T, l, L, C, rng = args
+    with phase(metrics, "build events"):
+        streams = buildEventsForInfiniteBuffer(T, l, L, C, rng)
+    return infiniteBufferDes(mergeEventStreams(*streams), T, L, C, metrics=metrics)
+
+# Builds the event times and runs the array based engine in the same worker, so only the
+# result is sent back to the parent process.
+@memoized
+def lindleyInfiniteBufferDesWrapper(args, metrics=None):
+    T, l, L, C, rng = args
+    with phase(metrics, "build events"):
+        arrival_times, departure_times, observer_times = buildTimesForInfiniteBuffer(T, l, L, C, rng)
+    return lindleyInfiniteBufferDes(arrival_times, departure_times, observer_times, T, metrics)
+
+# Generates events on the fly and runs the DES in the same worker, so no events are
+# sent between processes. The event generation is part of the DES phase of the metrics.
+@memoized
+def streamingInfiniteBufferDesWrapper(args, metrics=None):
+    T, l, L, C, rng = args
+    streams = streamEventsForInfiniteBuffer(T, l, L, C, rng)
+    return infiniteBufferDes(mergeEventStreams(*streams), T, L, C, metrics=metrics)
+
+# Uses the closed form results where they exist (rho < 1), and only simulates the remaining
+# points with the array based engine.
+def analyticInfiniteBufferWrapper(args, metrics=None):
+    T, l, L, C, rng = args
+    result = analyticInfiniteBuffer(l * L / C)
+    if result is None:
+        result = lindleyInfiniteBufferDesWrapper(args, metrics=metrics)
+    return result
+
+# Worker task for each engine of the infinite buffer case. Each one takes (T, l, L, C, rng)
+# and returns only the (e_n, p_idle) tuple for that value of rho, and takes optional metrics
+# (see Common/metrics.py) as a keyword argument. The simulated engines are
+# memoized (see Common/memo.py), so while the cache is enabled, rerunning a sweep with the
+# same seed returns the cached results.
+INFINITE_BUFFER_ENGINES = {
+    "events": infiniteBufferDesWrapper,
+    "lindley": lindleyInfiniteBufferDesWrapper,
+    "stream": streamingInfiniteBufferDesWrapper,
+    "analytic": analyticInfiniteBufferWrapper,
+}
+
+# Replication mode for the infinite buffer case. Runs independent replications of length T
+# with the given engine until the confidence intervals of e_n and p_idle are within
+# relative_precision of their means (see Common/confidence.py for the other options).
+# Returns the (e_n, p_idle) means, their confidence interval half widths and the number
+# of replications that were run.
+# Every replication draws from its own child stream of rng. With antithetic=True, every replication
+# is the average of an antithetic pair of runs (see Common/rngstreams.py). If metrics are given,
+# they add up over all replications, and the number of replications is added to them.
+def adaptiveInfiniteBufferDes(T, l, L, C, engine="lindley", relative_precision=0.05, rng=None, antithetic=False, metrics=None, **kwargs):
+    task = INFINITE_BUFFER_ENGINES[engine]
+    replicate = replications(lambda stream: task((T, l, L, C, stream), metrics=metrics), ensure_stream(rng), antithetic)
+    results = run_until_precision(replicate, relative_precision, **kwargs)
+    if metrics is not None:
+        metrics.count(replications=results[2])
+    return results
+
+# Worker task for q3 in replication mode, which only returns the (e_n, p_idle) means.
+def adaptiveInfiniteBufferDesWrapper(args, metrics=None):
+    T, l, L, C, rng, engine, relative_precision, antithetic = args
+    return adaptiveInfiniteBufferDes(T, l, L, C, engine, relative_precision, rng, antithetic, metrics)[0]
+
+# Builds the arrival, departure and observer times in a worker and writes them into a
+# shared memory block instead of pickling them back to the parent. Returns the name of the
+# block and the length of each stream, to be read with attachSharedTimes(...).
+# The block is registered with the resource tracker of the worker, so the parent must
+# start its own tracker with resource_tracker.ensure_running() before creating the pool.
+# The workers then share it, and the block is only unregistered when the parent unlinks
+# it, instead of being removed when the worker exits (see checkLindleyAgainstEvents(...)).
+def buildTimesForInfiniteBufferSharedWrapper(args):
+    streams = buildTimesForInfiniteBuffer(*args)
+    lengths = tuple(len(stream) for stream in streams)
+
+    block = shared_memory.SharedMemory(create=True, size=max(sum(lengths), 1) * 8)
+    buffer = np.ndarray(sum(lengths), dtype=np.float64, buffer=block.buf)
+    buffer[:] = np.concatenate(streams)
+    del buffer
+    block.close()
+    return (block.name, lengths)
+
+# Attaches to the times written by buildTimesForInfiniteBufferSharedWrapper(...) and yields
+# the (arrival, departure, observer) arrays as views into the shared block, without copying.
+# The block is freed when the with statement exits, so the arrays must not be used after it.
+@contextmanager
+def attachSharedTimes(name, lengths):
+    block = shared_memory.SharedMemory(name=name)
+    buffer = np.ndarray(sum(lengths), dtype=np.float64, buffer=block.buf)
+    offsets = np.cumsum((0,) + lengths).tolist()
+    try:
+        yield tuple(buffer[offsets[i]:offsets[i + 1]] for i in range(len(lengths)))
+    finally:
+        del buffer
+        block.close()
+        block.unlink()
+
+# Builds the arrival, departure and observer times of every value of rho in parallel,
+# passing them back to this process through shared memory, and checks that replaying
+# them as events with infiniteBufferDes(...) gives the same E[N] and P_idle as the array
+# based lindleyInfiniteBufferDes(...). Prints and returns the (rho, events result,
+# lindley result) of every mismatch.
+def checkLindleyAgainstEvents(rho_list=(0.25, 0.55, 0.95), T=100, L=2000, C=10 ** 6, seed=1, processes=None):
+    args = [(T, rho * C / L, L, C, rng) for rho, rng in zip(rho_list, sweep_streams(seed, len(rho_list)))]
+
+    # Start the resource tracker before the workers are created, so that they share it
+    # with this process (see buildTimesForInfiniteBufferSharedWrapper(...)).
+    resource_tracker.ensure_running()
+    with Pool(processes or cpu_count()) as pool:
+        blocks = pool.map(buildTimesForInfiniteBufferSharedWrapper, args)
+
+    mismatches = []
+    for rho, (name, lengths) in zip(rho_list, blocks):
+        with attachSharedTimes(name, lengths) as (arrival_times, departure_times, observer_times):
+            lindley_result = lindleyInfiniteBufferDes(arrival_times, departure_times, observer_times, T)
+            events = mergeEventStreams(EventStore.fromTimes((arrival_times, ARRIVAL)),
+                                       EventStore.fromTimes((departure_times, DEPARTURE)),
+                                       EventStore.fromTimes((observer_times, OBSERVER)))
+            events_result = infiniteBufferDes(events, T, L, C)
+        if not all(math.isclose(a, b) for a, b in zip(events_result, lindley_result)):
+            mismatches.append((rho, events_result, lindley_result))
+            print(f"rho = {rho}: events give {events_result}, lindley gives {lindley_result}")
+    return mismatches
 
 def finiteBufferDesWrapper(args):
     return finiteBufferDes(*args)
@@ -205,41 +610,131 @@ def finiteBufferDesWrapper(args):
 def buildEventsForFiniteBufferWrapper(args):
     return buildEventsForFiniteDes(*args)
 
-# Takes ~7 minutes for T = 1000
-def q3(T=1000):
+# Replication mode for the finite buffer case. Runs independent replications of length T
+# until the confidence intervals of e_n, p_loss and p_idle are within relative_precision of
+# their means, or within absolute_precision for values close to 0 such as p_loss at low load.
+# Returns the (e_n, p_loss, p_idle) means, their confidence interval half widths and the
+# number of replications that were run. antithetic and metrics are the same as for
+# adaptiveInfiniteBufferDes(...).
+def adaptiveFiniteBufferDes(T, l, L, C, K, relative_precision=0.05, rng=None, antithetic=False, metrics=None, **kwargs):
+    def simulate(stream):
+        with phase(metrics, "build events"):
+            events = buildEventsForFiniteDes(T, l, stream)
+        return finiteBufferDes(T, l, L, C, K, events, rng=stream, metrics=metrics)
+
+    replicate = replications(simulate, ensure_stream(rng), antithetic)
+    results = run_until_precision(replicate, relative_precision, **kwargs)
+    if metrics is not None:
+        metrics.count(replications=results[2])
+    return results
+
+# Builds the arrival and observer events for one value of rho once, and runs the finite
+# buffer DES on them for every value of K, since the events do not depend on K.
+# Returns one (e_n, p_loss, p_idle) tuple per value of K. If relative_precision is set,
+# this is repeated as replications until the results for every K are precise enough, and
+# the means are returned instead (with antithetic pairs of runs if antithetic is set).
+def finiteBufferSweepWrapper(args, metrics=None):
+    T, l, L, C, K_steps, rng, relative_precision, absolute_precision, antithetic = args
+    rng = ensure_stream(rng)
+
+    def simulate(stream):
+        with phase(metrics, "build events"):
+            events = buildEventsForFiniteDes(T, l, stream)
+        return [finiteBufferDes(T, l, L, C, K, events, rng=stream, metrics=metrics) for K in K_steps]
+
+    if relative_precision is None:
+        return simulate(rng)
+
+    replicate = replications(lambda stream: sum(simulate(stream), ()), rng, antithetic)
+    means, _, replication_count = run_until_precision(replicate, relative_precision, absolute_precision)
+    if metrics is not None:
+        metrics.count(replications=replication_count)
+    return [means[3 * j:3 * j + 3] for j in range(len(K_steps))]
+
+# Runs task(args, metrics=metrics) with a Metrics (see Common/metrics.py) and appends its
+# report to the JSON lines file report_path.
+def runWithReport(report_args):
+    task, args, report_path, track_memory = report_args
+    with Metrics({"task": task.__name__, "args": args}, track_memory) as metrics:
+        result = task(args, metrics=metrics)
+    metrics.write(report_path)
+    return result
+
+# Runs task on every set of args in grid across all CPU cores, and returns the results
+# in the same order as grid. If a ResultStore (see Common/results.py) is given, every
+# result is written to it as soon as it completes, and args that are already in the
+# store are not run again. If report_path is given, the metrics report of every set of
+# args that is run is appended to it (with the peak memory if track_memory is set).
+def runSweep(task, grid, processes=None, store=None, report_path=None, track_memory=False):
+    keys = [store.key(task, args) for args in grid] if store is not None else None
+    if report_path is not None:
+        task, grid = runWithReport, [(task, args, report_path, track_memory) for args in grid]
+
+    if store is None:
+        with Pool(processes or cpu_count()) as pool:
+            return pool.map(task, grid)
+
+    missing = [i for i in range(len(grid)) if keys[i] not in store]
+    if missing:
+        with Pool(processes or cpu_count()) as pool:
+            for i, result in zip(missing, pool.imap(task, [grid[i] for i in missing])):
+                store[keys[i]] = result
+    return [store[key] for key in keys]
+
+# Opens the ResultStore at results_path, or returns None if results_path is None.
+def openResultStore(results_path):
+    return ResultStore(results_path) if results_path is not None else None
+
+# Takes a few minutes for T = 1000 with engine="events", and a few seconds with engine="lindley".
+# If relative_precision is set, each value of rho is simulated in replication mode, with T being
+# the length of each replication, until E[N] and P_idle are within relative_precision.
+# With engine="analytic", the closed form results are plotted instead of simulating, and with
+# validate=True, simulated results that are too far from the closed form results are printed.
+# Every value of rho gets its own independent stream spawned from seed, so passing the same
+# seed reproduces the same results. With common_random_numbers=True, every value of rho uses
+# the same random numbers instead, which gives a much smoother curve for the same T, and with
+# antithetic=True, replication mode runs antithetic pairs of replications.
+# If results_path is set, every value of rho is checkpointed to that JSON lines file as soon as it
+# completes, and reruns with the same seed only simulate the values that are not in it yet.
+# If report_path is set, the metrics report of every value of rho (phase times, event counts, and
+# peak memory if report_memory is set) is appended to that JSON lines file.
+def q3(T=1000, engine="events", relative_precision=None, validate=False, seed=None, common_random_numbers=False, antithetic=False,
+       results_path=None, report_path=None, report_memory=False):
     # Setup lists to append values to as: 0.25 < rho < 0.95.
     E_N = []
     P_idle = []
 
-    # Total # of CPU cores we can use to multiprocess the simulation.
-    pool = Pool(cpu_count())
-
     C, L, = 10 ** 6, 2000
     rho_list = [0.25, 0.35, 0.45, 0.55, 0.65, 0.75, 0.85, 0.95]
     
     events_list_args = []
+    streams = sweep_streams(seed, len(rho_list), common_random_numbers)
 
     # For each value of rho, we compute the arrival rate, and append to our
     # args list to be used for generating all events for all rho.
-    for rho in rho_list:
+    for rho, rng in zip(rho_list, streams):
         l = rho * (C / L)
-        events_list_args.append((T, l, L, C))
+        events_list_args.append((T, l, L, C, rng))
     
-    # List of arr/obs/dep events for each value of rho from 0.25 to 0.95.
-    events_list = pool.map(buildEventsForInfiniteBufferWrapper, events_list_args)
+    # Each worker builds the events for its value of rho and runs the DES, so only
+    # the e_n and p_idle values are sent back. The sweep uses all CPU cores.
+    store = openResultStore(results_path)
+    if relative_precision is None:
+        results = runSweep(INFINITE_BUFFER_ENGINES[engine], events_list_args, store=store, report_path=report_path, track_memory=report_memory)
+    else:
+        adaptive_args = [args + (engine, relative_precision, antithetic) for args in events_list_args]
+        results = runSweep(adaptiveInfiniteBufferDesWrapper, adaptive_args, store=store, report_path=report_path, track_memory=report_memory)
+    if store is not None:
+        store.close()
 
-    # For each list of events, append to our args list for the DES.
-    des_args = []
-    for events in events_list:
-        des_args.append((events, T, L, C))
-    
-    # Multiprocess the DES, and strip out the e_n and p_idle values from each
-    # simulation for each rho.
-    results = pool.map(infiniteBufferDesWrapper, des_args)
     for result in results:
         E_N.append(result[0])
         P_idle.append(result[1])
 
+    if validate:
+        for rho, result in zip(rho_list, results):
+            checkAgainstAnalytic(f"rho = {rho}", result, analyticInfiniteBuffer(rho))
+
     f = plt.figure()
     plt.plot(rho_list, E_N)
     plt.title(r'E[N] vs $\rho$')
@@ -256,15 +751,23 @@ def q3(T=1000):
     plt.show()
     f.savefig("pidle_q3_figure.pdf")
 
-def q4():
+def q4(engine="events", seed=None):
     rho, C, L = 1.2, 10 ** 6, 2000
     l = rho * (C / L)
     T = 1000
-    events = buildEventsForInfiniteBuffer(T, l, L, C)
-    des = infiniteBufferDes(events, T, L, C)
+    des = INFINITE_BUFFER_ENGINES[engine]((T, l, L, C, RandomStream(seed)))
     print(des[0], des[1])
 
-def q6(T=1000):
+# If relative_precision is set, each value of rho is simulated in replication mode, with T being
+# the length of each replication, until E[N] and P_loss are within relative_precision (or within
+# absolute_precision, in %, for P_loss values close to 0).
+# With analytic=True, the closed form results are plotted instead of simulating, and with
+# validate=True, simulated results that are too far from the closed form results are printed.
+# Every value of rho gets its own independent stream spawned from seed, so passing the same
+# seed reproduces the same results. common_random_numbers, antithetic, results_path, report_path
+# and report_memory are the same as for q3(...).
+def q6(T=1000, relative_precision=None, absolute_precision=0.01, analytic=False, validate=False, seed=None,
+       common_random_numbers=False, antithetic=False, results_path=None, report_path=None, report_memory=False):
     # setup lists to append values to
     E_Ns = []
     P_LOSSes = []
@@ -277,25 +780,36 @@ def q6(T=1000):
     K_steps = [10, 25, 50]
     L, C = 2000, 10 ** 6
 
-    # for each queue:
-    # 1. calculate average number of packets arrived (lambda) for 
-    #    each value of rho
-    # 2. generate events
+    # for each value of rho, in parallel across all CPU cores:
+    # 1. calculate average number of packets arrived (lambda)
+    # 2. generate events, once for all values of K
     # 3. run finite buffer simulation (M/M/1/K) with generated events
-    # 4. extract two metrics: average number of packets in queue 
-    #    (E[N]) and packet loss probability (Ploss) from each 
-    #    simulation result
-    for K in K_steps:
-        e_n = []
-        p_loss = []
-        for rho in rho_steps:
-            l = rho * (C / L)
-            events = buildEventsForFiniteDes(T, l)
-            des = finiteBufferDes(T, l, L, C, K, events)
-            e_n.append(des[0])
-            p_loss.append(des[1])
-        E_Ns.append(e_n)
-        P_LOSSes.append(p_loss)
+    #    for each value of K
+    sweep_args = []
+    streams = sweep_streams(seed, len(rho_steps), common_random_numbers)
+    for rho, rng in zip(rho_steps, streams):
+        l = rho * (C / L)
+        sweep_args.append((T, l, L, C, K_steps, rng, relative_precision, absolute_precision, antithetic))
+    if analytic:
+        results = [[analyticFiniteBuffer(rho, K) for K in K_steps] for rho in rho_steps]
+    else:
+        store = openResultStore(results_path)
+        results = runSweep(finiteBufferSweepWrapper, sweep_args, store=store, report_path=report_path, track_memory=report_memory)
+        if store is not None:
+            store.close()
+
+    if validate and not analytic:
+        for i, rho in enumerate(rho_steps):
+            for j, K in enumerate(K_steps):
+                checkAgainstAnalytic(f"rho = {rho}, K = {K}", results[i][j], analyticFiniteBuffer(rho, K))
+
+    # extract two metrics for each queue: average number of packets in 
+    # queue (E[N]) and packet loss probability (Ploss) from each 
+    # simulation result, where results[i][j] is the result for the 
+    # i-th value of rho and the j-th value of K
+    for j in range(len(K_steps)):
+        E_Ns.append([results[i][j][0] for i in range(len(rho_steps))])
+        P_LOSSes.append([results[i][j][1] for i in range(len(rho_steps))])
 
     # plot E[N] as a function of rho for each K
     f = plt.figure()
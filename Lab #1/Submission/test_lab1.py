@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+import lab1
+
+# Runs code in a new Python process in this folder, and returns what it wrote to stderr.
+def run_python(code):
+    process = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+                             capture_output=True, text=True)
+    return process.stderr
+
+# Runs code with Numba blocked, so the simulators take their pure Python paths and jit kernels run as plain Python,
+# whether or not Numba is installed.
+def run_without_numba(code):
+    run_python("import sys; sys.modules['numba'] = None; " + code)
+
+# The finiteBufferDes kernel (compiled if Numba is installed) and the event kernel path must give the same results
+# and leave the random stream in the same state.
+def test_compiled_kernel():
+    assert not lab1.checkCompiledKernel()
+
+def test_compiled_kernel_without_numba():
+    run_without_numba("import lab1; assert not lab1.NUMBA_AVAILABLE; assert not lab1.checkCompiledKernel()")
+
+# Both infinite buffer engines must agree on the times the workers pass back through shared memory, and the blocks
+# must be freed by the parent alone, without the resource tracker reporting leaked or missing shared memory when the
+# process exits.
+def test_lindley_against_events():
+    stderr = run_python("import lab1; assert not lab1.checkLindleyAgainstEvents()")
+    assert "resource_tracker" not in stderr
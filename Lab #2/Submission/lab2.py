@@ -1,52 +1,320 @@
 import os
+import sys
 # import matplotlib as mpl
 # if os.environ.get('DISPLAY','') == '':
 #     print('no display found. Using non-interactive Agg backend')
 #     mpl.use('Agg')
 import matplotlib.pyplot as plt
-import random
 import math
-import collections
-
-def generate_random_variable(l=5):
-    u = random.uniform(0, 1)
-    x = (-1 / l) * math.log(1 - u)
-    return x
-
-class Packet:
-    def __init__(self, arrival_time, collisions, bus_busy_counter):
-        self.arrival_time = arrival_time
-        self.collisions = collisions
-        self.bus_busy_counter = bus_busy_counter
-
+import bisect
+import functools
+import numpy as np
+from array import array
+from multiprocessing import Pool, cpu_count
+
+# Helpers shared by both labs live in the Common folder at the root of the repo. It goes first on the path,
+# so installed packages with the same generic module names (metrics, results, memo, ...) do not shadow them.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from confidence import run_until_precision
+from rngstreams import RandomStream, ensure_stream, sweep_streams, replications
+from results import ResultStore
+from memo import memoized
+from eventkernel import EventKernel
+from metrics import Metrics, phase
+from jit import jit, NUMBA_AVAILABLE
+
+# All random variables are drawn from an explicit RandomStream (see Common/rngstreams.py), which the methods
+# below take as their rng parameter. If no stream is given, the default stream of the process is used (see
+# ensure_stream(...)), which is seeded from fresh OS entropy.
+# The inverse transform itself is RandomStream.exponential(...).
+def generate_random_variable(l=5, rng=None):
+    return ensure_stream(rng).exponential(l)
+
+# Vectorized version of generate_random_variable, returns n exponential random variables with rate l
+# as a NumPy array using the same inverse transform.
+def generate_random_variables(l, n, rng=None):
+    return ensure_stream(rng).exponentials(l, n)
+
+# Columnar store of a node's packets. Instead of one object per packet, the arrival times of the packets
+# are kept in an array('d'), and their collision and bus busy counters in array('b')s, with head being the
+# index of the packet at the front of the queue. Popping the head packet only advances the index.
+# Packet arrivals are generated lazily, block_size packets at a time, as the head reaches the end of the
+# current block. Only a small window of future packets exists at any time, and no packets are ever
+# generated at or after T_sim. The arrivals are drawn from the node's own stream rng.
 class Node:
-    def __init__(self, packets):
-        self.packets = packets
-
-# Creates nodes and populates them with a queue of packets, based on inputs.
+    def __init__(self, A, T_sim, block_size=256, rng=None):
+        self.A = A
+        self.T_sim = T_sim
+        self.block_size = block_size
+        self.rng = ensure_stream(rng)
+        self.last_arrival_time = 0
+        self.generate_packets()
+
+    # Number of packets left in the current block, which is not the number of packets left in the node, since the
+    # next blocks are only generated as the current one is emptied.
+    def buffered(self):
+        return len(self.arrival_times) - self.head
+
+    # Replaces the current block with the next block of packets, whose arrival times continue from the last
+    # generated arrival time as the cumulative sum of exponential inter-arrival times with rate A.
+    def generate_packets(self):
+        times = np.empty(0)
+        if self.last_arrival_time < self.T_sim:
+            times = self.last_arrival_time + np.cumsum(generate_random_variables(self.A, self.block_size, self.rng))
+            times = times[:np.searchsorted(times, self.T_sim)]
+
+            # Once T_sim is reached, the node does not generate any more packets.
+            self.last_arrival_time = times[-1] if len(times) == self.block_size else self.T_sim
+
+        self.arrival_times = array('d', times.tobytes())
+        self.collisions = array('b', bytes(len(times)))
+        self.bus_busy_counters = array('b', bytes(len(times)))
+        self.head = 0
+
+    # Removes the head packet from the queue, after it was transmitted or dropped. We update the arrival time of
+    # the next packet in the node if there is one, but only if it is less than the removed packet's arrival time.
+    def pop_packet(self):
+        last_arrival_time = self.arrival_times[self.head]
+        self.head += 1
+        if self.head == len(self.arrival_times):
+            self.generate_packets()
+        if self.head < len(self.arrival_times) and self.arrival_times[self.head] < last_arrival_time:
+            self.arrival_times[self.head] = last_arrival_time
+
+# Creates nodes, which generate their queue of packets as the simulation advances, based on inputs.
 # N: number of nodes.
 # A: arrival rate of packets at each node.
 # T_sim: desired simulation time.
+# block_size: number of packets each node generates at a time.
+# rng: stream from which every node gets its own child stream, so a node's arrivals do not depend on when
+# the other nodes generate their blocks.
 # The output is a list of nodes.
-def populate_nodes(N, A, T_sim):
-    nodes = []
+def populate_nodes(N, A, T_sim, block_size=256, rng=None):
+    # Packet arrival times follow a Poisson distribution with packet arrival rate defined by A,
+    # for all nodes, defined by N.
+    return [Node(A, T_sim, block_size, node_rng) for node_rng in ensure_stream(rng).spawn(N)]
+
+# Event type of a transmission attempt in the event kernel (see Common/eventkernel.py), whose payload is the index
+# of the transmitting node.
+TRANSMISSION = 0
+
+# Copies node i's head packet arrival time into head_times (infinity if the node is empty), and (re)schedules the
+# transmission attempt of that packet in the kernel, with the node index as its priority so the lowest index transmits
+# first on ties. This must be called whenever a node's head packet changes (backoff, deferral, drop or transmission).
+def schedule_node(kernel, transmissions, head_times, nodes, i):
+    node = nodes[i]
+    if node.head < len(node.arrival_times):
+        arrival_time = node.arrival_times[node.head]
+        head_times[i] = arrival_time
+        if transmissions[i] is None:
+            transmissions[i] = kernel.schedule(arrival_time, TRANSMISSION, i, priority=i)
+        else:
+            transmissions[i] = kernel.reschedule(transmissions[i], arrival_time)
+    else:
+        head_times[i] = float('inf')
+        if transmissions[i] is not None:
+            kernel.cancel(transmissions[i])
+            transmissions[i] = None
+
+# Distribution of how a non-persistent packet with busy bus counter busy_count leaves a busy bus window, when it is ready
+# slots backoff slots (rounded up, at least 1) before the window ends. The packet keeps sensing the bus: each time, its
+# counter goes up by 1 and it waits a random number of slots in [0, 2^counter - 1], until it has waited at least slots in
+# total (it leaves the window), or its counter is 10 (it is dropped). Outcome (counter - busy_count - 1) * slots + k is
+# leaving the window with that counter, after having waited k < slots slots before the last wait, and the last outcome is
+# the drop. The probabilities are computed by dynamic programming over the slots waited so far, and the method outputs
+# their cumulative sums, so an outcome is drawn with a single uniform.
+@functools.lru_cache(maxsize=None)
+def busy_bus_exit_cdf(busy_count, slots):
+    # waiting[k] is the probability that the packet is still in the window after waiting k slots in total.
+    waiting = [1.0] + [0.0] * (slots - 1)
+    probabilities = []
+    for counter in range(busy_count + 1, 11):
+        n = 2 ** counter
+        next_waiting = [0.0] * slots
+        for k in range(slots):
+            probabilities.append(waiting[k] * max(0, n - (slots - k)) / n)
+            for x in range(min(n, slots - k)):
+                next_waiting[k + x] += waiting[k] / n
+        waiting = next_waiting
+    cdf = [0.0] * len(probabilities)
+    total = 0.0
+    for j, probability in enumerate(probabilities):
+        total += probability
+        cdf[j] = total
+    # The drop takes up the rest, so any uniform in [0, 1) maps to an outcome.
+    return cdf + [1.0]
+
+# All busy_bus_exit_cdf(...) outputs for windows up to max_slots long, for csma_cd_kernel(...). Row [busy_count, slots] is
+# padded with 1s after the drop outcome.
+def busy_bus_exit_table(max_slots):
+    table = np.ones((11, max_slots + 1, 10 * max_slots + 1))
+    for busy_count in range(11):
+        for slots in range(1, max_slots + 1):
+            cdf = busy_bus_exit_cdf(busy_count, slots)
+            table[busy_count, slots, :len(cdf)] = cdf
+    return table
+
+# Array version of Node.pop_packet() for csma_cd_kernel(...), which also resets the counters of node i's head packet
+# and updates head_times[i]. The next packet is always in node i's window, since csma_cd_kernel(...) has it refilled in time.
+@jit
+def pop_packet_arrays(windows, ends, heads, head_times, collision_counts, busy_counts, i):
+    last_arrival_time = windows[i, heads[i]]
+    heads[i] += 1
+    collision_counts[i], busy_counts[i] = 0, 0
+    if heads[i] < ends[i]:
+        if windows[i, heads[i]] < last_arrival_time:
+            windows[i, heads[i]] = last_arrival_time
+        head_times[i] = windows[i, heads[i]]
+    else:
+        head_times[i] = np.inf
+
+# Array version of the persistent (persistent=True) and non-persistent CSMA/CD simulations below, compiled with Numba when it is
+# installed (see Common/jit.py). The packets node i has generated and not sent yet are in its window windows[i, heads[i]:ends[i]],
+# more[i] is set if it still has packets to generate, the collision and busy bus counters of its head packet are collision_counts[i]
+# and busy_counts[i], and head_times[i] is its head packet arrival time (infinity if it is empty).
+# The node with the smallest head time (the lowest index on ties) transmits next, like in the event kernel. Backoffs are drawn from
+# uniforms, from uniforms[used] on, in the same order as the simulations draw them from their rng, and busy_bus_table is
+# busy_bus_exit_table(...). A transmission attempt pops at most 2 packets from a node, so the kernel stops before an attempt if a node
+# that still has packets to generate has fewer than 3 in its window (KERNEL_NEEDS_PACKETS), or if fewer than 2 * N + 1 uniforms are
+# left (KERNEL_NEEDS_UNIFORMS). It can then be called again once they are refilled, and the node state and counters ([events,
+# transmissions, successful transmissions, collisions, backoffs, drops, deferrals]) carry over between calls.
+# The method outputs the index of the next unused uniform, and KERNEL_DONE, KERNEL_NEEDS_PACKETS or KERNEL_NEEDS_UNIFORMS.
+@jit
+def csma_cd_kernel(persistent, windows, ends, heads, more, head_times, collision_counts, busy_counts, prop_delays, busy_bus_table,
+                   uniforms, used, T_sim, L, R, counters):
+    N = len(head_times)
+    while True:
+        min_queue_idx = np.argmin(head_times)
+        curr_time = head_times[min_queue_idx]
+        if curr_time >= T_sim:
+            return (used, KERNEL_DONE)
+        for i in range(N):
+            if more[i] and ends[i] - heads[i] < 3:
+                return (used, KERNEL_NEEDS_PACKETS)
+        if len(uniforms) - used < 2 * N + 1:
+            return (used, KERNEL_NEEDS_UNIFORMS)
+        counters[0] += 1
 
-    # Create packet arrival times using Poisson distribution with packet arrival
-    # rate defined by A. We create a deque, and as long as each arrival time is valid we
-    # add to the deque. We then create a node with those packets at the end and repeat this
-    # process for all nodes, defined by N.
-    for i in range(N):
-        curr_time = 0
-        packets = collections.deque()
+        # Every other node whose head packet is ready before the first bit reaches it collides, and backs off or drops its packet.
+        collision_detected = False
+        for idx in range(N):
+            if idx == min_queue_idx or head_times[idx] > curr_time + prop_delays[abs(idx - min_queue_idx)]:
+                continue
+            counters[1] += 1
+            collision_detected = True
+            collision_counts[idx] += 1
+            counters[3] += 1
+            if collision_counts[idx] > 10:
+                pop_packet_arrays(windows, ends, heads, head_times, collision_counts, busy_counts, idx)
+                counters[5] += 1
+            else:
+                windows[idx, heads[idx]] += int(uniforms[used] * 2 ** collision_counts[idx]) * (512 / R)
+                used += 1
+                head_times[idx] = windows[idx, heads[idx]]
+                counters[4] += 1
 
-        while curr_time < T_sim:
-            curr_time += generate_random_variable(A)
-            if curr_time < T_sim:
-                packets.append(Packet(curr_time, 0, 0))
-        
-        nodes.append(Node(packets))
-    
-    return nodes
+        busy_counts[min_queue_idx] = 0
+        if collision_detected:
+            counters[1] += 1
+            collision_counts[min_queue_idx] += 1
+            counters[3] += 1
+            if collision_counts[min_queue_idx] > 10:
+                pop_packet_arrays(windows, ends, heads, head_times, collision_counts, busy_counts, min_queue_idx)
+                counters[5] += 1
+            else:
+                windows[min_queue_idx, heads[min_queue_idx]] += int(uniforms[used] * 2 ** collision_counts[min_queue_idx]) * (512 / R)
+                used += 1
+                head_times[min_queue_idx] = windows[min_queue_idx, heads[min_queue_idx]]
+                counters[4] += 1
+            continue
+
+        counters[1] += 1
+        counters[2] += 1
+        pop_packet_arrays(windows, ends, heads, head_times, collision_counts, busy_counts, min_queue_idx)
+
+        # Packets that are ready while the bus is busy at their node wait until it is idle (persistent), or keep sensing it after
+        # random waits, and are dropped after 10 of them (non-persistent), which is drawn at once like in non_persistent_csma_cd(...).
+        for i in range(N):
+            busy_start = curr_time + prop_delays[abs(i - min_queue_idx)]
+            busy_end = busy_start + L / R
+            if not busy_start <= head_times[i] < busy_end:
+                continue
+            if persistent:
+                windows[i, heads[i]] = busy_end
+                counters[6] += 1
+            else:
+                busy_count = busy_counts[i]
+                slots = max(1, math.ceil((busy_end - windows[i, heads[i]]) / (512 / R)))
+                cdf = busy_bus_table[busy_count, slots]
+                outcome = 0
+                while cdf[outcome] <= uniforms[used]:
+                    outcome += 1
+                used += 1
+                if outcome == (10 - busy_count) * slots:
+                    counters[6] += 10 - busy_count
+                    pop_packet_arrays(windows, ends, heads, head_times, collision_counts, busy_counts, i)
+                    counters[5] += 1
+                else:
+                    counter, waited = busy_count + 1 + outcome // slots, outcome % slots
+                    waited += (slots - waited) + int(uniforms[used] * (2 ** counter - 1 - (slots - waited) + 1))
+                    used += 1
+                    busy_counts[i] = counter
+                    windows[i, heads[i]] += waited * (512 / R)
+                    counters[6] += counter - busy_count
+            if heads[i] < ends[i]:
+                head_times[i] = windows[i, heads[i]]
+
+# Statuses returned by csma_cd_kernel(...).
+KERNEL_DONE, KERNEL_NEEDS_PACKETS, KERNEL_NEEDS_UNIFORMS = 0, 1, 2
+
+# Runs csma_cd_kernel(...) on nodes (from populate_nodes(...)). The nodes still generate their packets one block at a time: each
+# node's window holds its current block, after the (at most 2) packets left from the previous one, and is refilled from
+# node.generate_packets() whenever the kernel returns KERNEL_NEEDS_PACKETS. The uniforms are drawn from rng in chunks, and only the
+# ones the kernel used are consumed, so rng ends up in the same state as after the event kernel simulations.
+# The method outputs the [events, transmissions, successful transmissions, collisions, backoffs, drops, deferrals] counters.
+def run_csma_cd_kernel(persistent, nodes, T_sim, D, S, L, R, rng, chunk_size=65536):
+    N = len(nodes)
+    windows = np.empty((N, max(node.block_size for node in nodes) + 2))
+    ends = np.array([node.buffered() for node in nodes], dtype=np.int64)
+    heads = np.zeros(N, dtype=np.int64)
+    more = np.array([node.last_arrival_time < node.T_sim for node in nodes])
+    for i, node in enumerate(nodes):
+        windows[i, :ends[i]] = node.arrival_times[node.head:]
+    head_times = np.where(ends > 0, windows[:, 0], np.inf)
+
+    collision_counts, busy_counts = np.zeros(N, dtype=np.int64), np.zeros(N, dtype=np.int64)
+    prop_delays = (D / S) * np.arange(N)
+    # A busy window is L / R long, plus at most a rounding error.
+    busy_bus_table = busy_bus_exit_table(math.ceil((L / R) / (512 / R)) + 1)
+    counters = np.zeros(7, dtype=np.int64)
+
+    state = rng.get_state()
+    uniforms, used = rng.next_uniforms(max(chunk_size, 2 * N + 1)), 0
+    while True:
+        used, status = csma_cd_kernel(persistent, windows, ends, heads, more, head_times, collision_counts, busy_counts, prop_delays,
+                                      busy_bus_table, uniforms, used, T_sim, L, R, counters)
+        if status == KERNEL_DONE:
+            break
+        if status == KERNEL_NEEDS_UNIFORMS:
+            # Consume the used uniforms, and draw the next chunk after them.
+            rng.set_state(state)
+            rng.next_uniforms(used)
+            state = rng.get_state()
+            uniforms, used = rng.next_uniforms(max(chunk_size, 2 * N + 1)), 0
+            continue
+        for i in np.flatnonzero(more & (ends - heads < 3)).tolist():
+            node = nodes[i]
+            while more[i] and ends[i] - heads[i] < 3:
+                # Move the packets left to the start of the window, and append the node's next block after them.
+                left = ends[i] - heads[i]
+                windows[i, :left] = windows[i, heads[i]:ends[i]]
+                node.generate_packets()
+                windows[i, left:left + len(node.arrival_times)] = node.arrival_times
+                heads[i], ends[i] = 0, left + len(node.arrival_times)
+                more[i] = node.last_arrival_time < node.T_sim
+    rng.set_state(state)
+    rng.next_uniforms(used)
+    return counters.tolist()
 
 # Simulates the persistent CSMA/CD network scenario.
 # N: number of the nodes on the network.
@@ -56,112 +324,137 @@ def populate_nodes(N, A, T_sim):
 # S: propagation speed of the medium.
 # L: packet size.
 # R: transmission rate over the link.
-# The method outputs the efficiency and throughput of the network based on the inputs.
-def persistent_csma_cd(N, A, T_sim, D, S, L, R):
-    # Generate arrival packets at each node up to the simulation time.
-    nodes = populate_nodes(N, A, T_sim)
+# trace: optional trace sink (see Common/tracing.py). Every transmission attempt is recorded to it
+# as a (time, transmitting node index, collision detected) tuple, e.g. BinaryTraceSink("trace.bin", "<dI?").
+# rng: random stream (see Common/rngstreams.py) to draw packet arrivals and backoffs from.
+# metrics: optional metrics (see Common/metrics.py), to which the time spent creating the nodes and simulating, and the number
+# of processed events, transmissions, collisions, backoffs, drops and busy bus deferrals are added.
+# compiled: when Numba is installed and there is no trace sink, the simulation runs as the compiled csma_cd_kernel(...), which gives
+# the same results from the same rng. True or False forces the kernel or the event kernel simulation, and True raises ValueError
+# with a trace sink, which the kernel cannot record to.
+# The method outputs the efficiency and throughput of the network based on the inputs. While the cache in Common/memo.py
+# is enabled, results are cached by their inputs and the state of rng.
+@memoized
+def persistent_csma_cd(N, A, T_sim, D, S, L, R, trace=None, rng=None, metrics=None, compiled=None):
+    rng = ensure_stream(rng)
+
+    # Create the nodes, which generate arrival packets up to the simulation time as it advances.
+    with phase(metrics, "populate nodes"):
+        nodes = populate_nodes(N, A, T_sim, rng=rng)
+
+    if compiled is None:
+        compiled = NUMBA_AVAILABLE and trace is None
+    elif compiled and trace is not None:
+        raise ValueError("compiled=True cannot record a trace")
+    if compiled:
+        with phase(metrics, "simulation"):
+            counters = run_csma_cd_kernel(True, nodes, T_sim, D, S, L, R, rng)
+        return csma_cd_results(*counters, T_sim, L, metrics)
 
     # Variables to keep track of successful and overall number of transmissions.
     success_tx, total_tx = 0, 0
 
-    # Variables to keep track of simulation time and transmitting node index.
-    curr_time, min_queue_idx = 0, 0
-    
-    while curr_time < T_sim:
+    # Counters for the metrics, which are cheap enough to always keep track of.
+    collisions, backoffs, drops, deferrals = 0, 0, 0, 0
 
-        # Compute the node (and associated node index) that has smallest packet arrival time, by checking
-        # if a node's latest packet arrival time is smaller than previous, smallest packet arrival time.
-        curr_time = float('inf')
-        for i in range(N):
-            if not len(nodes[i].packets) > 0:
-                continue
-            if nodes[i].packets[0].arrival_time < curr_time and nodes[i].packets[0].arrival_time < T_sim:
-                min_queue_idx = i
-                curr_time = nodes[i].packets[0].arrival_time
-        
-        # This indicates that all nodes are empty - exit condition from simulation.
-        if curr_time == float('inf'):
-            break
+    # Every node's head packet arrival time, as an array for vectorized collision and busy bus checks, and
+    # its pending transmission attempt in the event kernel, which picks the next transmitting node.
+    kernel = EventKernel()
+    transmissions = [None] * N
+    head_times = np.full(N, float('inf'))
+    for i in range(N):
+        schedule_node(kernel, transmissions, head_times, nodes, i)
 
-        print(curr_time)
+    # Propagation delay across a distance of k nodes, indexed by k. This only depends on the topology, so
+    # the delays from the transmitting node to every other node are a single lookup per transmission.
+    prop_delays = (D / S) * np.arange(N)
+    node_indices = np.arange(N)
+    
+    # Handles the transmission attempt of node min_queue_idx's head packet at curr_time, the smallest packet
+    # arrival time of all nodes.
+    def transmit(curr_time, min_queue_idx):
+        nonlocal success_tx, total_tx, collisions, backoffs, drops, deferrals
 
         # To keep track of any collisions between transmitting node and all other nodes.
         collision_detected = False
 
-        # Scan all nodes (except transmitting node) to determine if there are any collisions.
-        for idx, node in enumerate(nodes):
-            if idx == min_queue_idx:
-                continue
-            if not len(node.packets) > 0:
-                continue
+        # Propagation delay based on distance between transmitting and every other node.
+        T_props = prop_delays[np.abs(node_indices - min_queue_idx)]
+
+        # Determine which nodes (except transmitting node) have their latest packet time to be transmitted before first bit
+        # of transmitting node is received - this indicates a collision between the transmitting and that node.
+        colliding = head_times <= curr_time + T_props
+        colliding[min_queue_idx] = False
+
+        for idx in np.flatnonzero(colliding).tolist():
+            node = nodes[idx]
+            head = node.head
+
+            total_tx += 1
+            collision_detected = True
+
+            node.collisions[head] += 1
+            collisions += 1
             
-            packet = node.packets[0]
-            T_prop = (D / S) * abs(idx - min_queue_idx) # Propagation delay based on distance between transmitting and current node.
-
-            # Determine if node's latest packet time is to be transmitted before first bit of transmitting
-            # node is received - this indicates a collision between the transmitting and current loop node.
-            if packet.arrival_time <= nodes[min_queue_idx].packets[0].arrival_time + T_prop:
-                total_tx += 1
-                collision_detected = True
-
-                packet.collisions += 1
-                
-                # If the packet has been involved in more than 10 collisions, drop it and update the arrival time of the next packet in the node
-                # if there is one. We only change the packet's arrival time if it is less than the dropped packet's arrival time.
-                if packet.collisions > 10:
-                    last_packet = node.packets.popleft()
-                    if len(node.packets) > 0:
-                        node.packets[0].arrival_time = max(node.packets[0].arrival_time, last_packet.arrival_time)
-                else:
-                    # Apply an exponential backoff to the node's packet time based on number of collisions - time node must wait before it can
-                    # retransmit this packet.
-                    T_backoff = random.randint(0, 2**packet.collisions - 1) * (512 / R)
-                    packet.arrival_time += T_backoff
+            # If the packet has been involved in more than 10 collisions, drop it and update the arrival time of the next packet in the node
+            # if there is one.
+            if node.collisions[head] > 10:
+                node.pop_packet()
+                drops += 1
+            else:
+                # Apply an exponential backoff to the node's packet time based on number of collisions - time node must wait before it can
+                # retransmit this packet.
+                T_backoff = rng.randint(0, 2**node.collisions[head] - 1) * (512 / R)
+                node.arrival_times[head] += T_backoff
+                backoffs += 1
+            schedule_node(kernel, transmissions, head_times, nodes, idx)
         
-        # Helper variables to access transmitter node and packet.
+        if trace is not None:
+            trace.record(curr_time, min_queue_idx, collision_detected)
+
+        # Helper variables to access transmitter node and its head packet.
         transmitter_node = nodes[min_queue_idx]
-        transmitter_node_packet = transmitter_node.packets[0]
+        transmitter_head = transmitter_node.head
         
         # If the transmitting node collided with any other nodes, it's packet arrival time must be updated (or dropped). Otherwise, the packet
         # must be removed from the transmitting node's packet queue.
         if collision_detected:
             total_tx += 1
 
-            transmitter_node_packet.collisions += 1
-            if transmitter_node_packet.collisions > 10:
-                last_packet = transmitter_node.packets.popleft()
-                if len(transmitter_node.packets) > 0:
-                    transmitter_node.packets[0].arrival_time = max(transmitter_node.packets[0].arrival_time, last_packet.arrival_time)
+            transmitter_node.collisions[transmitter_head] += 1
+            collisions += 1
+            if transmitter_node.collisions[transmitter_head] > 10:
+                transmitter_node.pop_packet()
+                drops += 1
             else:
-                T_backoff = random.randint(0, 2**transmitter_node_packet.collisions - 1) * (512 / R)
-                transmitter_node_packet.arrival_time += T_backoff
+                T_backoff = rng.randint(0, 2**transmitter_node.collisions[transmitter_head] - 1) * (512 / R)
+                transmitter_node.arrival_times[transmitter_head] += T_backoff
+                backoffs += 1
+            schedule_node(kernel, transmissions, head_times, nodes, min_queue_idx)
         else:
             success_tx += 1
             total_tx += 1
 
-            last_packet = transmitter_node.packets.popleft()
-            if len(transmitter_node.packets) > 0:
-                transmitter_node.packets[0].arrival_time = max(transmitter_node.packets[0].arrival_time, last_packet.arrival_time)
+            transmitter_node.pop_packet()
+            schedule_node(kernel, transmissions, head_times, nodes, min_queue_idx)
             
-            # Scan every node on the bus and update the latest packet arrivals in the case that there were packets that were to be transmitted
-            # during a busy bus (while the transmitting node was transmitting).
-            for i in range(len(nodes)):
-                if not len(nodes[i].packets) > 0:
-                    continue
-
-                packet = nodes[i].packets[0]
-                T_prop = abs(i - min_queue_idx) * (D / S)
-
-                # If this node's packet was to be transmitted after the first bit, but before the last bit of the current transmitting node's packet,
-                # we must re-schedule the packet to after the last bit of the current transmitting node's packet passes this node  on the bus.
-                if transmitter_node_packet.arrival_time + T_prop <= packet.arrival_time < transmitter_node_packet.arrival_time + T_prop + L / R:
-                    packet.arrival_time = transmitter_node_packet.arrival_time + T_prop + L / R
-                    
-    print("Done simulation!")
-    efficiency = success_tx / total_tx
-    throughput = ((success_tx * L) / T_sim) / (10**6)
-    print(efficiency, throughput)
-    return (efficiency, throughput)
+            # Update the latest packet arrivals of every node on the bus in the case that there were packets that were to be transmitted
+            # during a busy bus (while the transmitting node was transmitting). If a node's packet was to be transmitted after the first bit,
+            # but before the last bit of the current transmitting node's packet, we must re-schedule the packet to after the last bit of the
+            # current transmitting node's packet passes this node on the bus.
+            busy_start = curr_time + T_props
+            busy_end = busy_start + L / R
+            for i in np.flatnonzero((busy_start <= head_times) & (head_times < busy_end)).tolist():
+                nodes[i].arrival_times[nodes[i].head] = busy_end[i]
+                deferrals += 1
+                schedule_node(kernel, transmissions, head_times, nodes, i)
+
+    # Process transmission attempts in order until the simulation time. The simulation also ends once all nodes
+    # are empty, or every remaining packet arrives after the simulation time.
+    kernel.on(TRANSMISSION, transmit)
+    with phase(metrics, "simulation"):
+        kernel.run(until=T_sim)
+    return csma_cd_results(kernel.processed, total_tx, success_tx, collisions, backoffs, drops, deferrals, T_sim, L, metrics)
 
 # Simulates the persistent CSMA/CD network scenario.
 # N: number of the nodes on the network.
@@ -171,128 +464,294 @@ def persistent_csma_cd(N, A, T_sim, D, S, L, R):
 # S: propagation speed of the medium.
 # L: packet size.
 # R: transmission rate over the link.
-# The method outputs the efficiency and throughput of the network based on the inputs.
-def non_persistent_csma_cd(N, A, T_sim, D, S, L, R):
-    # Generate arrival packets at each node up to the simulation time.
-    nodes = populate_nodes(N, A, T_sim)
+# trace: optional trace sink (see Common/tracing.py). Every transmission attempt is recorded to it
+# as a (time, transmitting node index, collision detected) tuple, e.g. BinaryTraceSink("trace.bin", "<dI?").
+# rng: random stream (see Common/rngstreams.py) to draw packet arrivals and backoffs from.
+# metrics: optional metrics (see Common/metrics.py), to which the time spent creating the nodes and simulating, and the number
+# of processed events, transmissions, collisions, backoffs, drops and busy bus deferrals are added.
+# compiled: when Numba is installed and there is no trace sink, the simulation runs as the compiled csma_cd_kernel(...), which gives
+# the same results from the same rng. True or False forces the kernel or the event kernel simulation, and True raises ValueError
+# with a trace sink, which the kernel cannot record to.
+# The method outputs the efficiency and throughput of the network based on the inputs. While the cache in Common/memo.py
+# is enabled, results are cached by their inputs and the state of rng.
+@memoized
+def non_persistent_csma_cd(N, A, T_sim, D, S, L, R, trace=None, rng=None, metrics=None, compiled=None):
+    rng = ensure_stream(rng)
+
+    # Create the nodes, which generate arrival packets up to the simulation time as it advances.
+    with phase(metrics, "populate nodes"):
+        nodes = populate_nodes(N, A, T_sim, rng=rng)
+
+    if compiled is None:
+        compiled = NUMBA_AVAILABLE and trace is None
+    elif compiled and trace is not None:
+        raise ValueError("compiled=True cannot record a trace")
+    if compiled:
+        with phase(metrics, "simulation"):
+            counters = run_csma_cd_kernel(False, nodes, T_sim, D, S, L, R, rng)
+        return csma_cd_results(*counters, T_sim, L, metrics)
 
     # Variables to keep track of successful and overall number of transmissions.
     success_tx, total_tx = 0, 0
 
-    # Variables to keep track of simulation time and transmitting node index.
-    curr_time, min_queue_idx = 0, 0
-    
-    while curr_time < T_sim:
+    # Counters for the metrics, which are cheap enough to always keep track of.
+    collisions, backoffs, drops, deferrals = 0, 0, 0, 0
 
-        # Compute the node (and associated node index) that has smallest packet arrival time, by checking
-        # if a node's latest packet arrival time is smaller than previous, smallest packet arrival time.
-        curr_time = float('inf')
-        for i in range(N):
-            if not len(nodes[i].packets) > 0:
-                continue
-            if nodes[i].packets[0].arrival_time < curr_time and nodes[i].packets[0].arrival_time < T_sim:
-                min_queue_idx = i
-                curr_time = nodes[i].packets[0].arrival_time
-        
-        # This indicates that all nodes are empty - exit condition from simulation.
-        if curr_time == float('inf'):
-            break
+    # Every node's head packet arrival time, as an array for vectorized collision and busy bus checks, and
+    # its pending transmission attempt in the event kernel, which picks the next transmitting node.
+    kernel = EventKernel()
+    transmissions = [None] * N
+    head_times = np.full(N, float('inf'))
+    for i in range(N):
+        schedule_node(kernel, transmissions, head_times, nodes, i)
 
-        # print(curr_time)
+    # Propagation delay across a distance of k nodes, indexed by k. This only depends on the topology, so
+    # the delays from the transmitting node to every other node are a single lookup per transmission.
+    prop_delays = (D / S) * np.arange(N)
+    node_indices = np.arange(N)
+    
+    # Handles the transmission attempt of node min_queue_idx's head packet at curr_time, the smallest packet
+    # arrival time of all nodes.
+    def transmit(curr_time, min_queue_idx):
+        nonlocal success_tx, total_tx, collisions, backoffs, drops, deferrals
 
         # To keep track of any collisions between transmitting node and all other nodes.
         collision_detected = False
 
-        # Scan all nodes (except transmitting node) to determine if there are any collisions.
-        for idx, node in enumerate(nodes):
-            if idx == min_queue_idx:
-                continue
-            if not len(node.packets) > 0:
-                continue
+        # Propagation delay based on distance between transmitting and every other node.
+        T_props = prop_delays[np.abs(node_indices - min_queue_idx)]
+
+        # Determine which nodes (except transmitting node) have their latest packet time to be transmitted before first bit
+        # of transmitting node is received - this indicates a collision between the transmitting and that node.
+        colliding = head_times <= curr_time + T_props
+        colliding[min_queue_idx] = False
+
+        for idx in np.flatnonzero(colliding).tolist():
+            node = nodes[idx]
+            head = node.head
+
+            total_tx += 1
+            collision_detected = True
+
+            node.collisions[head] += 1
+            collisions += 1
             
-            packet = node.packets[0]
-            T_prop = (D / S) * abs(idx - min_queue_idx) # Propagation delay based on distance between transmitting and current node.
-
-            # Determine if node's latest packet time is to be transmitted before first bit of transmitting
-            # node is received - this indicates a collision between the transmitting and current loop node.
-            if packet.arrival_time <= nodes[min_queue_idx].packets[0].arrival_time + T_prop:
-                total_tx += 1
-                collision_detected = True
-
-                packet.collisions += 1
-                
-                # If the packet has been involved in more than 10 collisions, drop it and update the arrival time of the next packet in the node
-                # if there is one. We only change the packet's arrival time if it is less than the dropped packet's arrival time.
-                if packet.collisions > 10:
-                    last_packet = node.packets.popleft()
-                    if len(node.packets) > 0:
-                        node.packets[0].arrival_time = max(node.packets[0].arrival_time, last_packet.arrival_time)
-                else:
-                    # Apply an exponential backoff to the node's packet time based on number of collisions - time node must wait before it can
-                    # retransmit this packet.
-                    T_backoff = random.randint(0, 2**packet.collisions - 1) * (512 / R)
-                    packet.arrival_time += T_backoff
+            # If the packet has been involved in more than 10 collisions, drop it and update the arrival time of the next packet in the node
+            # if there is one.
+            if node.collisions[head] > 10:
+                node.pop_packet()
+                drops += 1
+            else:
+                # Apply an exponential backoff to the node's packet time based on number of collisions - time node must wait before it can
+                # retransmit this packet.
+                T_backoff = rng.randint(0, 2**node.collisions[head] - 1) * (512 / R)
+                node.arrival_times[head] += T_backoff
+                backoffs += 1
+            schedule_node(kernel, transmissions, head_times, nodes, idx)
         
-        # Helper variables to access transmitter node and packet.
+        if trace is not None:
+            trace.record(curr_time, min_queue_idx, collision_detected)
+
+        # Helper variables to access transmitter node and its head packet.
         transmitter_node = nodes[min_queue_idx]
-        transmitter_node_packet = transmitter_node.packets[0]
+        transmitter_head = transmitter_node.head
 
         # Node was able to transmit which means it checked the bus, and it was idle
-        transmitter_node_packet.bus_busy_counter = 0
+        transmitter_node.bus_busy_counters[transmitter_head] = 0
         
         # If the transmitting node collided with any other nodes, it's packet arrival time must be updated (or dropped). Otherwise, the packet
         # must be removed from the transmitting node's packet queue.
         if collision_detected:
             total_tx += 1
 
-            transmitter_node_packet.collisions += 1
-            if transmitter_node_packet.collisions > 10:
-                last_packet = transmitter_node.packets.popleft()
-                if len(transmitter_node.packets) > 0:
-                    transmitter_node.packets[0].arrival_time = max(transmitter_node.packets[0].arrival_time, last_packet.arrival_time)
+            transmitter_node.collisions[transmitter_head] += 1
+            collisions += 1
+            if transmitter_node.collisions[transmitter_head] > 10:
+                transmitter_node.pop_packet()
+                drops += 1
             else:
-                T_backoff = random.randint(0, 2**transmitter_node_packet.collisions - 1) * (512 / R)
-                transmitter_node_packet.arrival_time += T_backoff
+                T_backoff = rng.randint(0, 2**transmitter_node.collisions[transmitter_head] - 1) * (512 / R)
+                transmitter_node.arrival_times[transmitter_head] += T_backoff
+                backoffs += 1
+            schedule_node(kernel, transmissions, head_times, nodes, min_queue_idx)
         else:
             success_tx += 1
             total_tx += 1
-            transmitter_node.bus_busy_counter = 0
 
-            # Node was able to successfully transmit the packet, so we reset the busy counter on the packet.
-            transmitter_node_packet.bus_busy_counter = 0
-
-            last_packet = transmitter_node.packets.popleft()
-            if len(transmitter_node.packets) > 0:
-                transmitter_node.packets[0].arrival_time = max(transmitter_node.packets[0].arrival_time, last_packet.arrival_time)
+            transmitter_node.pop_packet()
+            schedule_node(kernel, transmissions, head_times, nodes, min_queue_idx)
             
-            # Scan every node on the bus and update the latest packet arrivals in the case that there were packets that were to be transmitted
-            # during a busy bus (while the transmitting node was transmitting).
-            for i in range(len(nodes)):
-                if not len(nodes[i].packets) > 0:
-                    continue
-
-                packet = nodes[i].packets[0]
-                T_prop = abs(i - min_queue_idx) * (D / S)
-
-                # If this node's packet was to be transmitted after the first bit, but before the last bit of the current transmitting node's packet,
-                # we must re-schedule the packet to be its current time plus an exponential backoff
-                while transmitter_node_packet.arrival_time + T_prop <= packet.arrival_time < transmitter_node_packet.arrival_time + T_prop + L / R:
-                    if packet.bus_busy_counter < 10:
-                        packet.bus_busy_counter += 1
-                        T_random_wait = random.randint(0, 2**packet.bus_busy_counter - 1) * (512 / R)
-                        packet.arrival_time += T_random_wait
-                    else:
-                        last_packet = nodes[i].packets.popleft()
-                        if len(nodes[i].packets) > 0:
-                            nodes[i].packets[0].arrival_time = max(nodes[i].packets[0].arrival_time, last_packet.arrival_time)
-                        break
-                    
+            # Update the latest packet arrivals of every node on the bus in the case that there were packets that were to be transmitted
+            # during a busy bus (while the transmitting node was transmitting). If a node's packet was to be transmitted after the first bit,
+            # but before the last bit of the current transmitting node's packet, we must re-schedule the packet to be its current time plus
+            # an exponential backoff.
+            busy_start = curr_time + T_props
+            busy_end = busy_start + L / R
+            for i in np.flatnonzero((busy_start <= head_times) & (head_times < busy_end)).tolist():
+                # Instead of drawing the random waits one at a time until the packet leaves the busy window, draw how it
+                # leaves it (see busy_bus_exit_cdf(...)), and then its last wait given that it leaves, which has the same
+                # distribution with at most two draws.
+                node = nodes[i]
+                head = node.head
+                busy_count = node.bus_busy_counters[head]
+                slots = max(1, math.ceil((float(busy_end[i]) - node.arrival_times[head]) / (512 / R)))
+                cdf = busy_bus_exit_cdf(busy_count, slots)
+                outcome = bisect.bisect_right(cdf, rng.uniform())
+                if outcome == len(cdf) - 1:
+                    deferrals += 10 - busy_count
+                    node.pop_packet()
+                    drops += 1
+                else:
+                    counter, waited = busy_count + 1 + outcome // slots, outcome % slots
+                    waited += rng.randint(slots - waited, 2**counter - 1)
+                    node.bus_busy_counters[head] = counter
+                    node.arrival_times[head] += waited * (512 / R)
+                    deferrals += counter - busy_count
+                schedule_node(kernel, transmissions, head_times, nodes, i)
+
+    # Process transmission attempts in order until the simulation time. The simulation also ends once all nodes
+    # are empty, or every remaining packet arrives after the simulation time.
+    kernel.on(TRANSMISSION, transmit)
+    with phase(metrics, "simulation"):
+        kernel.run(until=T_sim)
+    return csma_cd_results(kernel.processed, total_tx, success_tx, collisions, backoffs, drops, deferrals, T_sim, L, metrics)
+
+# Adds the counters of a CSMA/CD simulation to metrics if given, and outputs its efficiency and throughput.
+def csma_cd_results(events, total_tx, success_tx, collisions, backoffs, drops, deferrals, T_sim, L, metrics):
+    if metrics is not None:
+        metrics.count(events=events, transmissions=total_tx, successful_transmissions=success_tx, collisions=collisions,
+                      backoffs=backoffs, drops=drops, deferrals=deferrals)
+
     print("Done simulation!")
     efficiency = success_tx / total_tx
     throughput = ((success_tx * L) / T_sim) / (10**6)
     print(efficiency, throughput)
     return (efficiency, throughput)
 
+# Replication mode for the CSMA/CD simulations. Runs independent replications of simulate with the given
+# inputs until the confidence intervals of the efficiency and throughput are within relative_precision of
+# their means (see Common/confidence.py for the other options). Every replication draws from its own child
+# stream of rng, and with antithetic=True, every replication is the average of an antithetic pair of runs
+# (see Common/rngstreams.py). If metrics are given, they add up over all replications, and the number of replications
+# is added to them.
+# The method outputs the (efficiency, throughput) means, their confidence interval half widths and the number
+# of replications that were run.
+def adaptive_csma_cd(simulate, N, A, T_sim, D, S, L, R, relative_precision=0.05, rng=None, antithetic=False, metrics=None, **kwargs):
+    replicate = replications(lambda stream: simulate(N, A, T_sim, D, S, L, R, rng=stream, metrics=metrics), ensure_stream(rng), antithetic)
+    results = run_until_precision(replicate, relative_precision, **kwargs)
+    if metrics is not None:
+        metrics.count(replications=results[2])
+    return results
+
+# Same as adaptive_csma_cd(...), but only outputs the (efficiency, throughput) means, like the simulations.
+def adaptive_csma_cd_means(simulate, relative_precision, *params, rng=None, antithetic=False, metrics=None):
+    return adaptive_csma_cd(simulate, *params, relative_precision=relative_precision, rng=rng, antithetic=antithetic, metrics=metrics)[0]
+
+# Runs a single sweep point in a worker process, drawing from the point's own stream, so the result does not
+# depend on which worker runs it or in which order. If report_path is set, the metrics report of the point
+# (see Common/metrics.py) is appended to that JSON lines file.
+def run_sweep_task(args):
+    simulate, rng, params, report_path, track_memory = args
+    if report_path is None:
+        return simulate(*params, rng=rng)
+
+    labels = {"simulate": simulate, "N": params[0], "A": params[1], "params": params}
+    with Metrics(labels, track_memory) as metrics:
+        result = simulate(*params, rng=rng, metrics=metrics)
+    metrics.write(report_path)
+    return result
+
+# Runs simulate(*params) for every params tuple in grid across all CPU cores.
+# simulate: simulation method, e.g. persistent_csma_cd.
+# grid: list of parameter tuples to pass to simulate.
+# seed: seed of the sweep. Each point gets an independent stream spawned from it, so reruns with the same seed are reproducible.
+# common_random_numbers: if set, every point gets a copy of the same stream instead, so the differences between points come from
+# their parameters and not from the random numbers (see Common/rngstreams.py).
+# cost: optional function estimating the runtime of a params tuple. The slowest points are started first, so the total runtime
+# approaches the runtime of the single slowest point instead of having it start last.
+# store: optional ResultStore (see Common/results.py). Every result is written to it as soon as it completes, and points that
+# are already in the store (same simulate, params and seed) are not run again.
+# report_path: optional JSON lines file, to which the metrics report of every point that is run is appended (with the peak
+# memory if track_memory is set).
+# The method outputs the list of results in the same order as grid.
+def run_sweep(simulate, grid, seed=None, cost=None, processes=None, common_random_numbers=False, store=None, report_path=None,
+              track_memory=False):
+    streams = sweep_streams(seed, len(grid), common_random_numbers)
+
+    results = [None] * len(grid)
+    keys = [None] * len(grid)
+    order = list(range(len(grid)))
+    if store is not None:
+        keys = [store.key(simulate, grid[i], streams[i]) for i in order]
+        for i in order:
+            if keys[i] in store:
+                results[i] = store[keys[i]]
+        order = [i for i in order if keys[i] not in store]
+
+    if cost is not None:
+        order.sort(key=lambda i: cost(grid[i]), reverse=True)
+
+    if order:
+        with Pool(processes or cpu_count()) as pool:
+            tasks = [(simulate, streams[i], grid[i], report_path, track_memory) for i in order]
+            for i, result in zip(order, pool.imap(run_sweep_task, tasks, chunksize=1)):
+                results[i] = result
+                if store is not None:
+                    store[keys[i]] = result
+    return results
+
+# Estimated runtime of a CSMA/CD sweep point: the number of packets (N * A * T_sim), times the cost of the per-node
+# checks on each transmission (N).
+def csma_cd_cost(params):
+    N, A, T_sim = params[:3]
+    return N * N * A * T_sim
+
+# Runs the CSMA/CD simulation for every combination of A and N in parallel, and outputs the efficiencies and
+# throughputs as one list per value of A, in the order of N. If relative_precision is set, each point is
+# simulated in replication mode, with T_sim being the length of each replication (and antithetic pairs of runs
+# if antithetic is set). With common_random_numbers=True, every point uses the same random numbers. If results_path is set,
+# every point is checkpointed to that JSON lines file as soon as it completes, and reruns with the same seed only simulate
+# the points that are not in it yet. If report_path is set, the metrics report of every point (phase times, event counts,
+# and peak memory if report_memory is set) is appended to that JSON lines file.
+def sweep_csma_cd(simulate, A, N, T_sim, D, S, L, R, seed=None, relative_precision=None, common_random_numbers=False, antithetic=False,
+                  results_path=None, report_path=None, report_memory=False):
+    grid = [(n, a, T_sim, D, S, L, R) for a in A for n in N]
+    if relative_precision is not None:
+        simulate = functools.partial(adaptive_csma_cd_means, simulate, relative_precision, antithetic=antithetic)
+    options = dict(cost=csma_cd_cost, common_random_numbers=common_random_numbers, report_path=report_path, track_memory=report_memory)
+    if results_path is None:
+        results = run_sweep(simulate, grid, seed, **options)
+    else:
+        with ResultStore(results_path) as store:
+            results = run_sweep(simulate, grid, seed, store=store, **options)
+
+    overall_efficiencies = []
+    overall_throughputs = []
+    for i in range(len(A)):
+        row = results[i * len(N):(i + 1) * len(N)]
+        overall_efficiencies.append([res[0] for res in row])
+        overall_throughputs.append([res[1] for res in row])
+    return (overall_efficiencies, overall_throughputs)
+
+# Checks that the compiled csma_cd_kernel(...) and the event kernel simulations give the same results and counters, and leave
+# rng in the same state, for every seed and (N, A) point. Without Numba, the kernel runs as Python, which checks its logic only.
+# The method outputs the (simulation name, seed, N, A) of every mismatch.
+def check_compiled_kernel(seeds=(1, 2, 3), points=((20, 7), (60, 20)), T_sim=10, D=10, S=2 * (10**8), L=1500, R=10**6):
+    mismatches = []
+    for simulate in (persistent_csma_cd, non_persistent_csma_cd):
+        for seed in seeds:
+            for N, A in points:
+                runs = []
+                for compiled in (True, False):
+                    rng = RandomStream(seed)
+                    with Metrics() as metrics:
+                        result = simulate(N, A, T_sim, D, S, L, R, rng=rng, metrics=metrics, compiled=compiled)
+                    runs.append((result, metrics.counters, rng.get_state()))
+                if runs[0] != runs[1]:
+                    mismatches.append((simulate.__name__, seed, N, A))
+                    print(f"{simulate.__name__} seed {seed}, N = {N}, A = {A}: kernel gives {runs[0][:2]}, event kernel gives {runs[1][:2]}")
+    return mismatches
+
 def test():
     N = [100]
     A = [20]
@@ -314,7 +773,8 @@ def test():
         plt.plot(N, res)
     # plt.show()
 
-def q1():
+def q1(seed=None, relative_precision=None, common_random_numbers=False, antithetic=False, results_path=None, report_path=None,
+       report_memory=False):
     A = [7, 10, 20]
     N = [20, 30, 40, 50, 60, 70, 80, 90, 100]
     T_sim = 1000
@@ -324,17 +784,9 @@ def q1():
     L = 1500
     R = 10**6
 
-    overall_efficiencies = []
-    overall_throughputs = []
-    for a in A:
-        efficiencies = []
-        throughputs = []
-        for n in N:
-            res = persistent_csma_cd(n, a, T_sim, D, S, L, R)
-            efficiencies.append(res[0])
-            throughputs.append(res[1])
-        overall_efficiencies.append(efficiencies)
-        overall_throughputs.append(throughputs)
+    # Simulate every (A, N) point in parallel across all CPU cores.
+    overall_efficiencies, overall_throughputs = sweep_csma_cd(persistent_csma_cd, A, N, T_sim, D, S, L, R, seed, relative_precision,
+                                                              common_random_numbers, antithetic, results_path, report_path, report_memory)
     
     f = plt.figure()
     for idx, efficiencies in enumerate(overall_efficiencies):
@@ -356,7 +808,8 @@ def q1():
     plt.show()
     f.savefig("persistent_csma_cd_tput")
 
-def q2():
+def q2(seed=None, relative_precision=None, common_random_numbers=False, antithetic=False, results_path=None, report_path=None,
+       report_memory=False):
     A = [7, 10, 20]
     N = [20, 40, 60, 80, 100]
     T_sim = 1000 
@@ -366,17 +819,9 @@ def q2():
     L = 1500
     R = 10**6
 
-    overall_efficiencies = []
-    overall_throughputs = []
-    for a in A:
-        efficiencies = []
-        throughputs = []
-        for n in N:
-            res = non_persistent_csma_cd(n, a, T_sim, D, S, L, R)
-            efficiencies.append(res[0])
-            throughputs.append(res[1])
-        overall_efficiencies.append(efficiencies)
-        overall_throughputs.append(throughputs)
+    # Simulate every (A, N) point in parallel across all CPU cores.
+    overall_efficiencies, overall_throughputs = sweep_csma_cd(non_persistent_csma_cd, A, N, T_sim, D, S, L, R, seed, relative_precision,
+                                                              common_random_numbers, antithetic, results_path, report_path, report_memory)
     
     f = plt.figure()
     for idx, efficiencies in enumerate(overall_efficiencies):
@@ -0,0 +1,18 @@
+import os
+import subprocess
+import sys
+import lab2
+
+# Runs code in a new Python process in this folder, with Numba blocked so the simulators take their pure Python
+# paths and jit kernels run as plain Python, whether or not Numba is installed.
+def run_without_numba(code):
+    script = "import sys; sys.modules['numba'] = None; " + code
+    subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)), check=True, capture_output=True)
+
+# The CSMA/CD kernel (compiled if Numba is installed) and the event kernel simulations must give the same results,
+# counters and random stream state.
+def test_compiled_kernel():
+    assert not lab2.check_compiled_kernel()
+
+def test_compiled_kernel_without_numba():
+    run_without_numba("import lab2; assert not lab2.NUMBA_AVAILABLE; assert not lab2.check_compiled_kernel(seeds=(1,))")